@@ -0,0 +1,40 @@
+class FixedCoalescing(object):
+    """Redraws once the form has been quiet for `debounce` seconds,
+    or `max_wait` seconds after the last draw if changes keep
+    coming."""
+    def __init__(self, debounce=0.75, max_wait=5.75):
+        self.debounce = debounce
+        self.max_wait = max_wait
+    @property
+    def delay(self):
+        return self.debounce
+    def record_send(self, seconds):
+        pass
+
+class AdaptiveCoalescing(FixedCoalescing):
+    """Like FixedCoalescing, but the debounce follows how long the
+    display actually takes to update: `ratio` times a running average
+    of the send time, kept between `minimum` and `maximum`.  A fast
+    framebuffer ends up with a short window and a slow e-paper panel
+    with a long one.
+
+    """
+    def __init__(self, debounce=0.75, max_wait=5.75,
+                 ratio=0.5, minimum=0.02, maximum=2.0, smoothing=0.25):
+        FixedCoalescing.__init__(self, debounce, max_wait)
+        self.ratio = ratio
+        self.minimum = minimum
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.send_time = None
+    @property
+    def delay(self):
+        if self.send_time is None:
+            return self.debounce
+        return min(self.maximum,
+                   max(self.minimum, self.send_time * self.ratio))
+    def record_send(self, seconds):
+        if self.send_time is None:
+            self.send_time = seconds
+        else:
+            self.send_time += (seconds - self.send_time) * self.smoothing
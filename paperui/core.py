@@ -9,8 +9,8 @@ except ImportError:
     def PervasiveDisplay():
         return None
 
-from PIL import Image, ImageFont, ImageDraw
-from pil2epd import convert
+from PIL import Image, ImageFont, ImageDraw, ImageChops
+from paperui.epd import encode, panel_box
 from fontlist import FontList
 from enums import enum
 
@@ -36,11 +36,106 @@ def pixels_to_chars(pixels, direction=directions.x):
     else:
         raise Exception("Direction must be x or y.")
 
+def changed_boxes(old, new, band_height=16):
+    """Returns bounding boxes around the pixels that differ between
+    two 1-bit images of the same size, one box per run of changed
+    horizontal bands, or None if the images cannot be compared."""
+    if old is None or old.size != new.size:
+        return None
+
+    difference = ImageChops.logical_xor(old, new)
+    bbox = difference.getbbox()
+    if not bbox:
+        return []
+
+    left, top, right, bottom = bbox
+    boxes = []
+
+    for band_top in range(top, bottom, band_height):
+        band_bottom = min(band_top + band_height, bottom)
+        band_box = difference.crop((left, band_top,
+                                    right, band_bottom)).getbbox()
+        if not band_box:
+            continue
+
+        box = (left + band_box[0], band_top + band_box[1],
+               left + band_box[2], band_top + band_box[3])
+
+        if boxes and boxes[-1][3] >= band_top:
+            # changes continue from the previous band; grow its box
+            last = boxes[-1]
+            boxes[-1] = (min(last[0], box[0]), last[1],
+                         max(last[2], box[2]), box[3])
+        else:
+            boxes.append(box)
+
+    return boxes
+
+def box_area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+class GlyphAtlas(object):
+    """Pre-rasterized 1-bit cells for every printable ASCII character
+    of a monospace font, so that drawing a string is a row of mask
+    pastes rather than a trip through FreeType."""
+    def __init__(self, font, chars=None):
+        if chars == None:
+            chars = [chr(c) for c in range(32, 127)]
+
+        try:
+            self.advance = font.getlength("0")
+        except AttributeError:
+            self.advance = font.getsize("0")[0]
+
+        ascent, descent = font.getmetrics()
+
+        # room for glyphs that overhang their cell
+        self.pad = int(math.ceil(self.advance))
+        size = (int(math.ceil(self.advance)) + self.pad * 2,
+                ascent + descent + self.pad * 2)
+
+        self.cells = {}
+        for c in chars:
+            cell = Image.new("1", size, 0)
+            ImageDraw.Draw(cell).text((self.pad, self.pad), c,
+                                      font=font, fill=1)
+            self.cells[c] = cell.getbbox() and cell
+    def draw(self, image, x, y, text):
+        """Draws text in black at (x, y), returning False without
+        drawing anything if a character is not in the atlas."""
+        try:
+            cells = [self.cells[c] for c in text]
+        except KeyError:
+            return False
+
+        x, y = x - self.pad, int(round(y)) - self.pad
+        for i in range(len(cells)):
+            if cells[i]:
+                image.paste(0, (int(round(x + i * self.advance)), y),
+                            cells[i])
+        return True
+
 class ScreenDrawer(object):
-    def __init__(self, width=800, height=480):
+    """Draws frames and sends them to a display.
+
+    The display needs `reset_data_pointer()`, `send_image(data)` and
+    `update_display()` for full refreshes, as PervasiveDisplay has.
+    If it also has `send_region(box, data)` and `update_partial()`,
+    only the parts of a frame that changed since the last one are
+    sent, with a full refresh every `full_refresh_interval` frames or
+    whenever more than `partial_area_limit` of the panel changed.
+
+    """
+    def __init__(self, width=800, height=480, display=None):
         self.screen = None
         self.size = (width, height)
 
+        self.full_refresh_interval = 50
+        self.partial_area_limit = 0.5
+        self._last_frame = None
+        self._partial_updates = 0
+        self._origin = (0, 0)
+
         try:
             fonts = FontList.all().by_partial_name("roboto mono").bold()
             font = [font for font in fonts
@@ -49,7 +144,11 @@ class ScreenDrawer(object):
             raise Exception("You must install the Roboto Mono font.")
         
         self.font = ImageFont.truetype(font["path"], size=15)
-        self.display = PervasiveDisplay()
+        self.atlas = GlyphAtlas(self.font)
+
+        if display is None:
+            display = PervasiveDisplay()
+        self.display = display
     def columns(self):
         return pixels_to_chars(self.size[0], directions.x)
     def rows(self):
@@ -60,24 +159,93 @@ class ScreenDrawer(object):
                                 1)
         self._drawer = ImageDraw.Draw(self.screen)
     def text(self, x, y, text):
-        self._drawer.text((x, y), text, font=self.font)
+        ox, oy = self._origin
+        if not self.atlas.draw(self.screen, x - ox, y - oy, text):
+            self._drawer.text((x - ox, y - oy), text, font=self.font)
     def rectangle(self, x, y, x1, y1, fill=False):
-        self._drawer.rectangle([x, y, x1, y1],
+        ox, oy = self._origin
+        self._drawer.rectangle([x - ox, y - oy, x1 - ox, y1 - oy],
                                outline=0,
                                fill=fill and 0 or 1)
     def line(self, x, y, x1, y1):
-        self._drawer.line([x, y, x1, y1])
+        ox, oy = self._origin
+        self._drawer.line([x - ox, y - oy, x1 - ox, y1 - oy])
     def image(self, x, y, image):
-        self.screen.paste(image, (x, y))
+        ox, oy = self._origin
+        self.screen.paste(image, (x - ox, y - oy))
+    def capture(self, x, y, width, height, draw):
+        """Calls `draw(self)` with drawing redirected to a blank
+        width x height image whose top-left corner is (x, y) on the
+        screen, and returns the result as a mask for `stamp`."""
+        saved = self.screen, self._drawer, self._origin
+
+        self.screen = Image.new("1",
+                                (int(math.ceil(width)),
+                                 int(math.ceil(height))),
+                                1)
+        self._drawer = ImageDraw.Draw(self.screen)
+        self._origin = (int(x), int(y))
+
+        try:
+            draw(self)
+            captured = self.screen
+        finally:
+            self.screen, self._drawer, self._origin = saved
+
+        return ImageChops.invert(captured.convert("L"))
+    def stamp(self, x, y, mask):
+        """Blacks out the pixels set in a mask made by `capture`."""
+        ox, oy = self._origin
+        self.screen.paste(0, (int(x) - ox, int(y) - oy), mask)
     def clear(self):
         self.new_screen()
         self.send()
     def epd(self):
-        return convert(self.screen)
+        return encode(self.screen)
     def screenshot(self, fn):
         self.screen.save(fn)
-    def send(self):
-        self.screen = self.screen.rotate(270)
+    def _can_send_partial(self, frame, boxes):
+        if not (hasattr(self.display, "send_region") and
+                hasattr(self.display, "update_partial")):
+            return False
+        if self._partial_updates >= self.full_refresh_interval:
+            return False
+
+        changed = sum([box_area(box) for box in boxes])
+        return changed <= box_area((0, 0) + frame.size) * self.partial_area_limit
+
+    def _send_full(self, frame):
         self.display.reset_data_pointer()
-        self.display.send_image(self.epd())
+        self.display.send_image(encode(frame))
         self.display.update_display()
+        self._partial_updates = 0
+
+    def _send_partial(self, frame, boxes):
+        for box in boxes:
+            self.display.send_region(box, encode(frame, box))
+        self.display.update_partial()
+        self._partial_updates += 1
+
+    def send(self, frame=None):
+        """Sends a frame, by default the screen being drawn, to the
+        display.  Returns whether anything on the display changed."""
+        if frame == None:
+            frame = self.screen
+
+        boxes = changed_boxes(self._last_frame, frame)
+        if boxes:
+            # regions are sent in the panel's orientation
+            boxes = [box for box in [panel_box(box, frame.size)
+                                     for box in boxes]
+                     if box]
+
+        if boxes == []:
+            # nothing on the panel would change
+            return False
+        elif boxes and self._can_send_partial(frame, boxes):
+            self._send_partial(frame, boxes)
+        else:
+            self._send_full(frame)
+
+        self._last_frame = frame
+        return True
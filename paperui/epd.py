@@ -0,0 +1,68 @@
+"""Encodes frames for the e-paper panel.
+
+The panel takes frames rotated as `Image.rotate(270)` leaves them,
+that is turned a quarter clockwise about the centre and cut back to
+the original size, packed eight pixels to a byte with black as 1.
+With NumPy the rotation is a strided view over the frame and the
+packing a single `packbits`, so the frame itself is never rotated;
+without it, frames go through PIL and pil2epd as before.
+
+"""
+from pil2epd import convert
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _shift(size):
+    width, height = size
+    return (width - height) // 2
+
+def panel_box(box, size):
+    """Returns where a box on a frame of the given size ends up on the
+    panel, widened to whole bytes, or None if it falls outside."""
+    width, height = size
+    shift = _shift(size)
+    left, top, right, bottom = box
+
+    panel = (max(height - bottom + shift, 0) // 8 * 8,
+             max(left - shift, 0),
+             min((height - top + shift + 7) // 8 * 8, width),
+             min(right - shift, height))
+
+    if panel[0] >= panel[2] or panel[1] >= panel[3]:
+        return None
+    return panel
+
+def panel_pixels(image):
+    """Returns the frame as the panel sees it, as an array of booleans
+    that are True for black."""
+    width, height = image.size
+    shift = _shift(image.size)
+
+    # rotated[i, j] is pixel (i, height - 1 - j) of the image
+    rotated = numpy.rot90(numpy.asarray(image), -1)
+    if shift == 0:
+        return ~rotated
+
+    panel = numpy.ones((height, width), dtype=bool)
+    top, bottom = max(0, -shift), min(height, width - shift)
+    left, right = max(0, shift), min(width, height + shift)
+    panel[top:bottom, left:right] = ~rotated[top + shift:bottom + shift,
+                                             left - shift:right - shift]
+    return panel
+
+def encode(image, box=None):
+    """Returns the panel's bytes for a frame, or for just the part of
+    the panel inside box."""
+    if numpy is None:
+        rotated = image.rotate(270)
+        if box:
+            rotated = rotated.crop(box)
+        return convert(rotated)
+
+    pixels = panel_pixels(image)
+    if box:
+        pixels = pixels[box[1]:box[3], box[0]:box[2]]
+    return numpy.packbits(pixels, axis=1).tobytes()
@@ -1,7 +1,7 @@
 import os
 import pygame
 import math
-from paperui.core import ScreenDrawer
+from paperui.core import ScreenDrawer, changed_boxes
 
 class FrameBufferDrawer(ScreenDrawer):
     def __init__(self):
@@ -12,6 +12,9 @@ class FrameBufferDrawer(ScreenDrawer):
         
 
         self.display = pygame.display.set_mode(self.size, pygame.FULLSCREEN)
+
+        # frames are sent as 8-bit greyscale, one byte per pixel
+        self._palette = [(i, i, i) for i in range(256)]
         
         # Clear the screen to start
         self.display.fill((255, 255, 255))
@@ -20,15 +23,27 @@ class FrameBufferDrawer(ScreenDrawer):
     def __del__(self):
         pass
 
-    def send(self):
-        self.display.fill((255, 255, 255))
-        
-        scrn = self.screen.convert("RGB").tobytes()
-        
-        img = pygame.image.fromstring(scrn, self.size, "RGB")
-        self.display.blit(img, (0,0))
-        
-        pygame.display.update()
+    def send(self, frame=None):
+        if frame == None:
+            frame = self.screen
+
+        boxes = changed_boxes(self._last_frame, frame)
+        if boxes == None:
+            boxes = [(0, 0) + self.size]
+
+        rects = []
+        for box in boxes:
+            region = frame.crop(box).convert("L")
+            surface = pygame.image.frombuffer(region.tobytes(),
+                                              region.size, "P")
+            surface.set_palette(self._palette)
+            rects.append(self.display.blit(surface, box[:2]))
+
+        if rects:
+            pygame.display.update(rects)
+
+        self._last_frame = frame
+        return bool(rects)
         
     def clear(self):
         self.new_screen()
@@ -0,0 +1,145 @@
+class FocusRing(object):
+    """The tab order of a container, as a circular doubly linked list
+    over its controls: stepping to the next or previous control, and
+    adding or removing one, take constant time."""
+    def __init__(self, controls=()):
+        self._next = {}
+        self._prev = {}
+        self.first = None
+        for control in controls:
+            self.append(control)
+
+    def __len__(self):
+        return len(self._next)
+
+    def __contains__(self, control):
+        return control in self._next
+
+    def __iter__(self):
+        control = self.first
+        for i in range(len(self._next)):
+            yield control
+            control = self._next[control]
+
+    def next(self, control):
+        return self._next[control]
+
+    def prev(self, control):
+        return self._prev[control]
+
+    def insert_after(self, anchor, control):
+        """Inserts control after anchor, or first if anchor is None."""
+        if self.first == None:
+            self._next[control] = self._prev[control] = control
+            self.first = control
+            return
+
+        if anchor == None:
+            anchor = self._prev[self.first]
+            self.first = control
+
+        following = self._next[anchor]
+        self._next[anchor] = control
+        self._prev[control] = anchor
+        self._next[control] = following
+        self._prev[following] = control
+
+    def append(self, control):
+        if self.first == None:
+            self.insert_after(None, control)
+        else:
+            self.insert_after(self._prev[self.first], control)
+
+    def remove(self, control):
+        following = self._next.pop(control)
+        preceding = self._prev.pop(control)
+        if following is control:
+            self.first = None
+            return
+        self._next[preceding] = following
+        self._prev[following] = preceding
+        if self.first is control:
+            self.first = following
+
+class GridIndex(object):
+    """Buckets controls by the cells of a grid that their rectangles
+    cover, to find the nearest control in a direction without looking
+    at all of them."""
+    def __init__(self, controls, cell=64):
+        self.cell = cell
+        self.cells = {}
+        self.rows = self.columns = (0, -1)
+
+        for control in controls:
+            if control.x == None or control.y == None:
+                continue
+            left, top, right, bottom = self._cell_box(control)
+            for column in range(left, right + 1):
+                for row in range(top, bottom + 1):
+                    self.cells.setdefault((column, row), []).append(control)
+
+        if self.cells:
+            self.columns = (min(c for c, r in self.cells),
+                            max(c for c, r in self.cells))
+            self.rows = (min(r for c, r in self.cells),
+                         max(r for c, r in self.cells))
+
+    def _cell_box(self, control):
+        return (int(control.x // self.cell),
+                int(control.y // self.cell),
+                int((control.x + max(control.width, 1) - 1) // self.cell),
+                int((control.y + max(control.height, 1) - 1) // self.cell))
+
+    @staticmethod
+    def _center(control):
+        return (control.x + control.width / 2.0,
+                control.y + control.height / 2.0)
+
+    def nearest(self, control, dx, dy, accept=None):
+        """Returns the control nearest to `control` in the direction
+        (dx, dy), one of which is 0, or None if there is none there.
+        Distance along the direction counts once and distance across
+        it twice.  `accept` may reject candidates, such as controls
+        that are not showing."""
+        x, y = self._center(control)
+        left, top, right, bottom = self._cell_box(control)
+
+        if dx:
+            start = dx > 0 and right or left
+            span = self.columns
+        else:
+            start = dy > 0 and bottom or top
+            span = self.rows
+        step = dx or dy
+
+        best, best_score = None, None
+        line = start
+        while span[0] <= line <= span[1]:
+            distance = abs(line - start) - 1
+            if best != None and distance * self.cell > best_score:
+                break
+
+            if dx:
+                cells = [(line, row)
+                         for row in range(self.rows[0], self.rows[1] + 1)]
+            else:
+                cells = [(column, line)
+                         for column in range(self.columns[0],
+                                             self.columns[1] + 1)]
+
+            for cell in cells:
+                for candidate in self.cells.get(cell, ()):
+                    cx, cy = self._center(candidate)
+                    along = (cx - x) * dx + (cy - y) * dy
+                    if candidate is control or along <= 0:
+                        continue
+                    score = along + 2 * abs((cx - x) * dy + (cy - y) * dx)
+                    if best_score != None and score >= best_score:
+                        continue
+                    if accept and not accept(candidate):
+                        continue
+                    best, best_score = candidate, score
+
+            line += step
+
+        return best
@@ -1,3 +1,11 @@
+import os
+import time
+import errno
+import asyncio
+from select import select
+from collections import deque
+from threading import Condition
+
 from evdev import *
 
 def keyboards():
@@ -12,28 +20,240 @@ def keyboards():
     devs = [dev_if_allowed(fn) for fn in list_devices()]
     return [dev for dev in devs if dev and "eybo" in dev.name]
 
+# keys whose held repeats may be collapsed into one event with a
+# count; any other key, and so every character, repeats one by one
+navigation_keys = set([ecodes.KEY_UP, ecodes.KEY_DOWN,
+                       ecodes.KEY_LEFT, ecodes.KEY_RIGHT,
+                       ecodes.KEY_PAGEUP, ecodes.KEY_PAGEDOWN,
+                       ecodes.KEY_HOME, ecodes.KEY_END])
+
+class FakeInputDevice(object):
+    """Stands in for an evdev InputDevice, giving out key events queued
+    with `press` or `queue`, so forms can be run without a keyboard.
+
+    Once the device is closed and its queue is empty, reading fails as
+    it would for an unplugged keyboard."""
+    def __init__(self, name="Fake keyboard"):
+        self.name = name
+        self.fn = None
+        self._events = deque()
+        self._closed = False
+        self._condition = Condition()
+
+        # written to whenever there are events, so select() works
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+
+    def fileno(self):
+        return self._wake_read
+
+    def queue(self, keycode, keystate=1):
+        if isinstance(keycode, str):
+            keycode = ecodes.ecodes[keycode]
+        now = time.time()
+        event = InputEvent(int(now), int(now % 1 * 1000000),
+                           ecodes.EV_KEY, keycode, keystate)
+        with self._condition:
+            self._events.append(event)
+            os.write(self._wake_write, b"k")
+            self._condition.notify_all()
+
+    def press(self, *keycodes):
+        """Queues a key down and key up for each keycode."""
+        for keycode in keycodes:
+            self.queue(keycode, 1)
+            self.queue(keycode, 0)
+
+    def hold(self, keycode, repeats):
+        """Queues a key held down for `repeats` repeats, then let go."""
+        self.queue(keycode, 1)
+        for i in range(repeats):
+            self.queue(keycode, 2)
+        self.queue(keycode, 0)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            os.write(self._wake_write, b"c")
+            self._condition.notify_all()
+
+    def _wait(self):
+        with self._condition:
+            while not self._events and not self._closed:
+                self._condition.wait()
+
+    def read(self):
+        """Returns every event waiting, like InputDevice.read."""
+        with self._condition:
+            try:
+                while os.read(self._wake_read, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+            if not self._events:
+                if self._closed:
+                    raise OSError(errno.ENODEV, "device closed")
+                raise BlockingIOError(errno.EAGAIN, "no events waiting")
+            events, self._events = list(self._events), deque()
+        return iter(events)
+
+    def read_loop(self):
+        while True:
+            self._wait()
+            try:
+                events = self.read()
+            except OSError:
+                return
+            for event in events:
+                yield event
+
+    async def async_read(self):
+        """Waits on the running loop for events, then reads them.  Unlike
+        waiting in an executor, this can be cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return self.read()
+            except BlockingIOError:
+                pass
+
+            ready = loop.create_future()
+            loop.add_reader(self._wake_read,
+                            lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(self._wake_read)
+
+    async def async_read_loop(self):
+        while True:
+            try:
+                events = await self.async_read()
+            except OSError:
+                return
+            for event in events:
+                yield event
+
+    def grab(self):
+        pass
+
+    def ungrab(self):
+        pass
+
 class KeyReader(object):
     """Reads key events in an endless loop, calling the handler for
-    each one."""
-    def __init__(self, device_fn):
-        self._device = InputDevice(device_fn)
+    each one.  `device` is the path to an input device, or a device
+    object such as a FakeInputDevice.
+
+    The handler is given evdev's integer scancode and the key state.
+    All the events waiting are read at once, and a run of held
+    navigation keys in them is passed on as one event, with the number
+    of repeats as a third argument to the handler."""
+    def __init__(self, device):
+        if isinstance(device, str):
+            self._device = InputDevice(device)
+        else:
+            self._device = device
         self._break = False
+        self._loop = None
+        self._read_task = None
     def stop(self):
+        """Ends the event loop, without waiting for another key if
+        `async_event_loop` is waiting for one.  May be called from any
+        thread."""
         self._break = True
+        task, loop = self._read_task, self._loop
+        if task != None and loop != None:
+            loop.call_soon_threadsafe(task.cancel)
+
+    def key_events(self, events):
+        """Yields (keycode, keystate, repeat) for the key events among
+        `events`, collapsing runs of held navigation keys."""
+        held, repeat = None, 0
+        for event in events:
+            if event.type != ecodes.EV_KEY:
+                continue
+
+            if (event.value == KeyEvent.key_hold and
+                event.code in navigation_keys):
+                if event.code == held:
+                    repeat += 1
+                    continue
+                if held != None:
+                    yield held, KeyEvent.key_hold, repeat
+                held, repeat = event.code, 1
+                continue
+
+            if held != None:
+                yield held, KeyEvent.key_hold, repeat
+                held = None
+            yield event.code, event.value, 1
+
+        if held != None:
+            yield held, KeyEvent.key_hold, repeat
+
+    def _handle_events(self, events, handler):
+        """Passes a batch of events to the handler, returning True once
+        the loop should end."""
+        for keycode, keystate, repeat in self.key_events(events):
+            if self._break:
+                return True
+            if repeat == 1:
+                handler(keycode, keystate)
+            else:
+                handler(keycode, keystate, repeat)
+            if keycode == ecodes.KEY_F12:
+                return True
+        return self._break
+
+    def _read(self):
+        try:
+            return self._device.read()
+        except BlockingIOError:
+            return ()
+
     def event_loop(self, handler):
         self._break = False
-        for event in self._device.read_loop():
-            if self._break:
-                break
-            if event.type == ecodes.EV_KEY:
-                cat = categorize(event)
-                if cat.keycode == "KEY_F12":
-                    handler(cat.keycode,
-                            cat.keystate)
+        while True:
+            select([self._device], [], [])
+            try:
+                events = self._read()
+            except OSError as e:
+                if e.errno == errno.ENODEV:
                     break
-                handler(cat.keycode,
-                        cat.keystate)
+                raise
+            if self._handle_events(events, handler):
+                break
 
+    async def async_event_loop(self, handler):
+        """Like `event_loop`, but reads events without blocking the
+        running asyncio loop."""
+        self._break = False
+        self._loop = asyncio.get_running_loop()
+        try:
+            while not self._break:
+                # kept so that stop() can cancel it
+                self._read_task = self._loop.create_task(
+                    self._device.async_read())
+                try:
+                    events = await self._read_task
+                except asyncio.CancelledError:
+                    if self._break:
+                        break
+                    raise
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    if e.errno == errno.ENODEV:
+                        break
+                    raise
+                finally:
+                    self._read_task = None
+                if self._handle_events(events, handler):
+                    break
+        finally:
+            self._loop = None
 
 class ExclusiveKeyReader(KeyReader):
     """Like a KeyReader object, except grabs the device for exclusive
@@ -41,8 +261,8 @@ class ExclusiveKeyReader(KeyReader):
     if an error occurs.
 
     """
-    def __init__(self, device_fn):
-        KeyReader.__init__(self, device_fn)
+    def __init__(self, device):
+        KeyReader.__init__(self, device)
     def __enter__(self):
         self._device.grab()
         return self
@@ -1,4 +1,7 @@
+from sys import intern
+
 from enums import enum
+from evdev import ecodes
 
 keystates = enum(down=1, up=0, hold=2)
 
@@ -43,30 +46,98 @@ for i in range(10):
     char_keys["KEY_%s" % i] = numeric_keys[i]
     char_keys["S-KEY_%s" % i] = numeric_keys[i+10]
 
+# modifier bits, as indexes into the translation table
+shift, ctrl, alt = 1, 2, 4
+
+modifier_bits = {
+    "KEY_LEFTSHIFT": shift,
+    "KEY_RIGHTSHIFT": shift,
+    "KEY_LEFTCTRL": ctrl,
+    "KEY_RIGHTCTRL": ctrl,
+    "KEY_CAPSLOCK": ctrl,
+    "KEY_LEFTALT": alt,
+    "KEY_RIGHTALT": alt
+}
+
+def modifier_prefix(modifiers):
+    return "%s%s%s" % (modifiers & alt and "A-" or "",
+                       modifiers & ctrl and "C-" or "",
+                       modifiers & shift and "S-" or "")
+
+# names <linux/input-event-codes.h> defines as another key's name
+key_aliases = frozenset([
+    "KEY_HANGUEL", "KEY_SCREENLOCK", "KEY_DIRECTION", "KEY_DASHBOARD",
+    "KEY_BRIGHTNESS_ZERO", "KEY_WIMAX", "KEY_ZOOM", "KEY_SCREEN",
+    "KEY_BRIGHTNESS_TOGGLE", "KEY_MIN_INTERESTING",
+    "BTN_A", "BTN_B", "BTN_X", "BTN_Y"
+])
+
+def key_name(scancode):
+    name = ecodes.KEY[scancode]
+    if isinstance(name, str):
+        return name
+    # several names for one code; prefer the key's own name to an
+    # alias or a bound such as KEY_MAX
+    names = [n for n in name
+             if n not in key_aliases and not n.endswith(("_MAX", "_CNT"))]
+    return (names or list(name))[0]
+
+def translation_table():
+    """Builds the table `KeyTranslator` looks keys up in: the entry
+    for a scancode and modifier bits is at `scancode << 3 | bits`, and
+    holds the key's char, or None, and its interned code, such as
+    "C-KEY_X"."""
+    table = [(None, None)] * ((max(ecodes.KEY) + 1) << 3)
+    for scancode in ecodes.KEY:
+        name = key_name(scancode)
+        for modifiers in range(8):
+            code = intern(modifier_prefix(modifiers) + name)
+            table[scancode << 3 | modifiers] = (char_keys.get(code), code)
+    return table
+
+_table = translation_table()
+_modifiers = dict((ecodes.ecodes[name], bit)
+                  for name, bit in modifier_bits.items())
+
 class KeyTranslator(object):
+    """Turns key events into a (char, code) pair, keeping track of the
+    modifier keys held.  Keycodes are evdev's integer scancodes; key
+    names such as "KEY_A" are still accepted."""
     def __init__(self):
-        self.alt, self.ctrl, self.shift = False, False, False
+        self.modifiers = 0
+
+    @property
+    def shift(self):
+        return bool(self.modifiers & shift)
+
+    @property
+    def ctrl(self):
+        return bool(self.modifiers & ctrl)
+
+    @property
+    def alt(self):
+        return bool(self.modifiers & alt)
+
     def _prefix(self):
-        return "%s%s%s" % (self.alt and "A-" or "",
-                           self.ctrl and "C-" or "",
-                           self.shift and "S-" or "")
+        return modifier_prefix(self.modifiers)
+
     def translate(self, keycode, keystate):
-        if keycode in buckies:
-            if keystate in [keystates.down, keystates.up]:
-                if keycode in ["KEY_LEFTSHIFT", "KEY_RIGHTSHIFT"]:
-                    self.shift = (not keystate == keystates.up)
-                elif keycode in ["KEY_LEFTCTRL", "KEY_RIGHTCTRL", "KEY_CAPSLOCK"]:
-                    self.ctrl = (not keystate == keystates.up)
-                elif keycode in ["KEY_LEFTALT", "KEY_RIGHTALT"]:
-                    self.alt = (not keystate == keystates.up)
-            return None, None
-
-        elif keystate in [keystates.down, keystates.hold]:
-            complete_code = "%s%s" % (self._prefix(), keycode)
+        if isinstance(keycode, str):
             try:
-                return char_keys[complete_code], complete_code
+                keycode = ecodes.ecodes[keycode]
             except KeyError:
-                return None, complete_code
-        else:
-            return None, None
-    
+                if keystate == keystates.up:
+                    return None, None
+                return None, self._prefix() + keycode
+
+        if keycode in _modifiers:
+            if keystate == keystates.down:
+                self.modifiers |= _modifiers[keycode]
+            elif keystate == keystates.up:
+                self.modifiers &= ~_modifiers[keycode]
+        elif keystate != keystates.up:
+            try:
+                return _table[keycode << 3 | self.modifiers]
+            except IndexError:
+                pass
+        return None, None
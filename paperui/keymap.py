@@ -0,0 +1,55 @@
+"""Key bindings.
+
+Widgets, containers and forms declare `bindings`: a dict from keys to
+the name of the method to call, which is given the number of times the
+key repeated.  Keys are codes as KeyTranslator gives them, such as
+"C-KEY_B", or several separated by spaces for a chord, such as
+"C-KEY_X C-KEY_S".  Binding a key to None unbinds it.
+
+A Form compiles the bindings that apply to its focused control into a
+single table, so that each key is resolved in one lookup.
+
+"""
+
+# bumped whenever bindings change, so compiled keymaps are rebuilt
+generation = 0
+
+def changed():
+    global generation
+    generation += 1
+
+def chord(keys):
+    return tuple(keys.split())
+
+def action_for(target, action):
+    """Returns a callable taking the repeat count for `action`, which
+    is a method name on `target` or a function of (target, count)."""
+    if isinstance(action, str):
+        return getattr(target, action)
+    return lambda count=1: action(target, count)
+
+def compile_keymap(layers):
+    """Compiles (target, bindings) layers, the lowest precedence first,
+    into a table from codes to actions.  The entry for the first code
+    of a chord is itself a table for the codes that may follow.
+
+    Where one layer binds a key and another binds a chord starting
+    with it, the layer with the higher precedence wins."""
+    flat = {}
+    for target, bindings in layers:
+        for keys, action in bindings.items():
+            codes = chord(keys)
+            for bound in list(flat):
+                shorter = min(len(bound), len(codes))
+                if bound[:shorter] == codes[:shorter]:
+                    del flat[bound]
+            if action != None:
+                flat[codes] = action_for(target, action)
+
+    table = {}
+    for codes, action in flat.items():
+        entry = table
+        for code in codes[:-1]:
+            entry = entry.setdefault(code, {})
+        entry[codes[-1]] = action
+    return table
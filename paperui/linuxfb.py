@@ -0,0 +1,97 @@
+import os
+import mmap
+import fcntl
+import struct
+from PIL import Image
+from paperui.core import ScreenDrawer, changed_boxes
+
+FBIOGET_VSCREENINFO = 0x4600
+FBIOGET_FSCREENINFO = 0x4602
+
+# struct fb_var_screeninfo is 40 __u32s: the geometry comes first,
+# then offset/length/msb_right for red, green, blue and transparency
+var_screeninfo = struct.Struct("40I")
+
+# struct fb_fix_screeninfo, laid out with native alignment
+fix_screeninfo = struct.Struct("16sLIIIIHHHILIIH2H0L")
+
+def screen_info(fd):
+    """Returns (width, height, bits_per_pixel, line_length) for an open
+    framebuffer device."""
+    var = var_screeninfo.unpack(
+        fcntl.ioctl(fd, FBIOGET_VSCREENINFO, bytes(var_screeninfo.size)))
+    fix = fix_screeninfo.unpack(
+        fcntl.ioctl(fd, FBIOGET_FSCREENINFO, bytes(fix_screeninfo.size)))
+    return var[0], var[1], var[6], fix[9]
+
+class LinuxFrameBufferDrawer(ScreenDrawer):
+    """Draws straight into a Linux framebuffer device by mapping it into
+    memory, without pygame.
+
+    The geometry is read from the device.  Anything else, such as a
+    plain file standing in for the device, needs width, height and
+    bits_per_pixel given, and line_length if rows are padded.  Frames
+    are 1-bit, so each pixel is written as all zero or all one bits,
+    which is black and white in any 8, 16, 24 or 32 bit format.
+
+    """
+    def __init__(self, device="/dev/fb0", width=None, height=None,
+                 bits_per_pixel=None, line_length=None):
+        self._fd = os.open(device, os.O_RDWR)
+
+        try:
+            width, height, bits_per_pixel, line_length = screen_info(self._fd)
+        except (IOError, OSError):
+            if not (width and height and bits_per_pixel):
+                os.close(self._fd)
+                raise Exception("%s is not a framebuffer; give its geometry." % device)
+
+        if bits_per_pixel not in (8, 16, 24, 32):
+            os.close(self._fd)
+            raise Exception("Unsupported framebuffer depth: %s bits." % bits_per_pixel)
+
+        self.bytes_per_pixel = bits_per_pixel // 8
+        self.line_length = line_length or width * self.bytes_per_pixel
+
+        self._buffer = mmap.mmap(self._fd, self.line_length * height)
+
+        ScreenDrawer.__init__(self, width=width, height=height,
+                              display=self._buffer)
+
+    def _rows(self, frame, top, bottom):
+        """Returns the framebuffer bytes for rows top to bottom of a
+        frame, without row padding."""
+        width = self.size[0]
+        rows = frame.crop((0, top, width, bottom)).convert("L")
+        if self.bytes_per_pixel > 1:
+            # repeat each pixel's byte across the whole pixel
+            rows = rows.resize((width * self.bytes_per_pixel, bottom - top),
+                               Image.NEAREST)
+        return rows.tobytes()
+
+    def send(self, frame=None):
+        if frame == None:
+            frame = self.screen
+
+        boxes = changed_boxes(self._last_frame, frame)
+        if boxes == None:
+            boxes = [(0, 0) + self.size]
+
+        row_bytes = self.size[0] * self.bytes_per_pixel
+
+        for left, top, right, bottom in boxes:
+            data = self._rows(frame, top, bottom)
+            if row_bytes == self.line_length:
+                self._buffer[top * row_bytes:bottom * row_bytes] = data
+            else:
+                for row in range(bottom - top):
+                    start = (top + row) * self.line_length
+                    self._buffer[start:start + row_bytes] = \
+                        data[row * row_bytes:(row + 1) * row_bytes]
+
+        self._last_frame = frame
+        return bool(boxes)
+
+    def close(self):
+        self._buffer.close()
+        os.close(self._fd)
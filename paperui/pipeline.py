@@ -0,0 +1,67 @@
+from datetime import datetime
+from threading import Thread, Condition
+
+class DisplayPipeline(object):
+    """Sends frames to a drawer's display on a worker thread, so that
+    the next frame can be drawn while the display is busy with the
+    last one.
+
+    Only the newest frame waiting to be sent is kept: one submitted
+    while another is still waiting replaces it and is counted as
+    dropped.  `on_sent` is called with the seconds each send took,
+    leaving out sends that found nothing to change on the display.
+
+    """
+    def __init__(self, drawer, on_sent=None):
+        self.drawer = drawer
+        self.on_sent = on_sent
+
+        self.rendered = 0
+        self.sent = 0
+        self.dropped = 0
+
+        self._pending = None
+        self._stopped = False
+        self._condition = Condition()
+
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, frame):
+        with self._condition:
+            self.rendered += 1
+            if self._pending != None:
+                self.dropped += 1
+            self._pending = frame
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending == None and not self._stopped:
+                    self._condition.wait()
+
+                if self._pending == None:
+                    return
+
+                frame, self._pending = self._pending, None
+
+            started = datetime.now()
+            changed = self.drawer.send(frame)
+            seconds = (datetime.now() - started).total_seconds()
+
+            with self._condition:
+                self.sent += 1
+
+            # a send that changed nothing says nothing about how long
+            # the display takes to update
+            if self.on_sent and changed != False:
+                self.on_sent(seconds)
+
+    def stop(self, timeout=None):
+        """Sends any frame still waiting, then stops the worker."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
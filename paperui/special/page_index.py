@@ -0,0 +1,98 @@
+import os
+import hashlib
+from array import array
+
+def default_directory():
+    cache = os.environ.get("XDG_CACHE_HOME",
+                           os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache, "paperui", "pages")
+
+class PageIndex(object):
+    """Stores where the pages of a text begin, so that a document
+    opened again with the same font, page size and margin need not be
+    paginated again.
+
+    Each entry is a file of unsigned ints named after a hash of the
+    text (or of a MappedText's fingerprint) and the layout: whether
+    pagination reached the end, the offset where the last page ends,
+    then the offset of each page start.
+
+    Every version of an edited text gets its own entry, so only the
+    `max_entries` used most recently are kept.
+
+    """
+    def __init__(self, directory=None, max_entries=64):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def _path(self, text, layout):
+        try:
+            digest = hashlib.sha1(text.fingerprint())
+        except AttributeError:
+            digest = hashlib.sha1(text.encode("utf-8", "surrogatepass"))
+        digest.update(repr(layout).encode("utf-8"))
+        return os.path.join(self.directory or default_directory(),
+                            digest.hexdigest())
+
+    def load(self, text, layout):
+        """Returns (starts, end, finished) for the text, or None if
+        it has not been stored."""
+        if layout[0] is None:
+            return None
+
+        path = self._path(text, layout)
+        entry = array("I")
+        try:
+            with open(path, "rb") as f:
+                entry.frombytes(f.read())
+            # keeps the entry from being the next one evicted
+            os.utime(path)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if len(entry) < 2:
+            return None
+
+        return entry[2:], entry[1], bool(entry[0])
+
+    def save(self, text, layout, starts, end, finished):
+        # fonts without a path cannot be told apart between runs
+        if layout[0] is None:
+            return
+
+        path = self._path(text, layout)
+        entry = array("I", [finished and 1 or 0, end])
+        entry.extend(starts)
+        replacing = os.path.exists(path)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(entry.tobytes())
+            os.replace(path + ".tmp", path)
+        except (IOError, OSError):
+            return
+
+        # only a new entry can take the directory over the limit
+        if not replacing:
+            self._evict(os.path.dirname(path))
+
+    def _evict(self, directory):
+        """Removes the least recently used entries beyond
+        `max_entries`."""
+        try:
+            entries = []
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                entries.append((os.stat(path).st_mtime, path))
+        except (IOError, OSError):
+            return
+
+        entries.sort()
+        for mtime, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except (IOError, OSError):
+                pass
+
+default_index = PageIndex()
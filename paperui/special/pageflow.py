@@ -1,3 +1,6 @@
+from bisect import bisect_left, bisect_right
+from array import array
+
 from paperui import ui
 from paperui.core import chars_to_pixels
 
@@ -29,73 +32,63 @@ class PageFlow(ui.Column):
     def focus_next(self):
         self.owner.focus_next()
 
-    def next_page(self):
+    bindings = {
+        "C-KEY_F": "next_page",
+        "KEY_F": "next_page",
+        "KEY_RIGHT": "next_page",
+        "C-KEY_B": "prev_page",
+        "KEY_B": "prev_page",
+        "KEY_LEFT": "prev_page"
+    }
+
+    def next_page(self, count=1):
         if self.current_page < len(self.pages) - 1:
-            self.current_page += 1
+            self.current_page = min(self.current_page + count,
+                                    len(self.pages) - 1)
             self.owner.dirty = True
             if self.owner.focused_control not in self.pages[self.current_page]:
                 self.owner.focus(self.pages[self.current_page][0])
         
-    def prev_page(self):
+    def prev_page(self, count=1):
         if self.current_page > 0:
-            self.current_page -= 1
+            self.current_page = max(self.current_page - count, 0)
             self.owner.dirty = True
             if self.owner.focused_control not in self.pages[self.current_page]:
                 self.owner.focus(self.pages[self.current_page][-1])
 
-    def handle_key(self, char, code):
-        if code in ["C-KEY_F", "KEY_F", "KEY_RIGHT"]:
-            self.next_page()
-        elif code in ["C-KEY_B", "KEY_B", "KEY_LEFT"]:
-            self.prev_page()
-        else:
-            return False
-        return True
-
-    def do_layout(self, x, y, width,  height, owner=None):
-        self.x = x
-        self.y = y
+    def _measure(self, width):
+        # as tall as a page may be, whatever is on the pages
+        return self.max_height + 22
 
-        self.owner = owner
-        self.width = width
-        
+    def _arrange(self, x, y, width, height, owner):
         self.pages = [Page(x, y),]
 
         for child in self.contents:
             cur_page = self.pages[-1]
+            child_height = child.measure(width)
             
-            if cur_page.height + child.height <= self.max_height:
-                
-                try:
-                    child.do_layout(x,
-                                    y + cur_page.height,
-                                    width,
-                                    height,
-                                    owner=self)
-                except AttributeError:
-                    child.x = x
-                    child.y = y + cur_page.height
-                    child.width = width
-                    child.owner = self
-            
-                cur_page.add(child)
-            else:
+            if cur_page.height + child_height > self.max_height:
                 self.pages.append(Page(x, y))
                 cur_page = self.pages[-1]
 
+            child.arrange(x, y + cur_page.height, width, height, self)
+            cur_page.add(child)
+
+        self._page_of = {}
+        for index, page in enumerate(self.pages):
+            for child in page:
                 try:
-                    child.do_layout(x,
-                                    y + cur_page.height,
-                                    width,
-                                    height,
-                                    owner=self)
+                    controls = child.focusable()
                 except AttributeError:
-                    child.x = x
-                    child.y = y + cur_page.height
-                    child.width = width
-                    child.owner = self
+                    controls = [child]
+                for control in controls:
+                    self._page_of[control] = index
 
-                cur_page.add(child)
+    def _owner_for(self, item):
+        return self
+
+    def shows(self, control):
+        return self._page_of.get(control) == self.current_page
             
     def draw_contents(self, drawer):
         for child in self.contents:
@@ -106,7 +99,7 @@ class PageFlow(ui.Column):
 
         for child in self.pages[self.current_page]:
             try:
-                child.draw(drawer)
+                child.render(drawer)
             except AttributeError:
                 child.draw_contents(drawer)
 
@@ -116,3 +109,220 @@ class PageFlow(ui.Column):
         x_offset = chars_to_pixels(len(message) + 1)
         
         drawer.text(self.width - x_offset, self.max_height, message)
+
+class VirtualPageFlow(PageFlow):
+    """A PageFlow over items that are only made into widgets while
+    their page, or one within `window` pages of it, is showing.
+
+    `factory(item, recycled)` returns the widget for an item.  With a
+    `count`, the items are the indexes 0 to count - 1; otherwise they
+    are taken from the `items` iterable as far as pages are turned.
+    `recycled` is a widget that has left the window, or None, which
+    the factory may set up for the new item and return.  Items are
+    `item_height` tall, or as tall as `height_of(item)` says; only in
+    the second case are the items measured, as far as pages are found.
+
+    Only the widgets in the window are in `contents`, so only they can
+    take focus or be found by name.
+
+    """
+    def __init__(self, factory, count=None, items=None, height_of=None,
+                 item_height=None, max_height=480, window=1):
+        PageFlow.__init__(self, [], max_height)
+
+        self.factory = factory
+        self.window = window
+
+        if item_height == None:
+            item_height = ui.line_width + ui.char_height + ui.line_width
+        self.height_of = height_of or (lambda item: item_height)
+
+        # with one height for every item, each page holds the same
+        # number of them and nothing needs measuring
+        if height_of == None:
+            self._per_page = max(int(self.max_height // item_height), 1)
+            self._item_height = item_height
+        else:
+            self._per_page = None
+
+        if count != None:
+            self._items = range(count)
+            self._source = None
+        else:
+            self._items = []
+            self._source = iter(items)
+
+        # _offsets[i] is the height of the items before item i, and
+        # _starts the first item of each page found so far, then the
+        # item after the last of those pages
+        self._offsets = array("d", [0])
+        self._starts = [0]
+
+        self._widgets = {}
+        self._index_of = {}
+        self._shown = []
+        self._recycled = []
+
+        self._materialize()
+
+    def _fetch(self, index):
+        """Returns whether there is an item at index, taking items from
+        the source as far as that."""
+        while self._source != None and len(self._items) <= index:
+            try:
+                self._items.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return index < len(self._items)
+
+    def _page_end(self, start):
+        if self._per_page != None:
+            self._fetch(start + self._per_page - 1)
+            return min(start + self._per_page, len(self._items))
+
+        limit = self._offsets[start] + self.max_height
+        offsets = self._offsets
+        while offsets[-1] <= limit and self._fetch(len(offsets) - 1):
+            offsets.append(offsets[-1] +
+                           self.height_of(self._items[len(offsets) - 1]))
+
+        end = bisect_right(offsets, limit, start) - 1
+        # an item taller than a page gets a page to itself
+        return max(end, start + 1)
+
+    def _page_range(self, page):
+        """Returns the first item of a page and the item after its last,
+        or None if there are not that many pages."""
+        if self._per_page != None:
+            start = page * self._per_page
+            if not self._fetch(start):
+                return None
+            return start, self._page_end(start)
+
+        while len(self._starts) <= page + 1:
+            start = self._starts[-1]
+            if not self._fetch(start):
+                break
+            self._starts.append(self._page_end(start))
+
+        if page + 1 < len(self._starts):
+            return self._starts[page], self._starts[page + 1]
+        return None
+
+    def _page_of_item(self, index):
+        if self._per_page != None:
+            return index // self._per_page
+        return bisect_right(self._starts, index) - 1
+
+    def _offset(self, index):
+        """Returns the height of the items before an item."""
+        if self._per_page != None:
+            return index * self._item_height
+        return self._offsets[index]
+
+    def page_count(self):
+        """Returns how many pages there are, or None while the items
+        are still being taken from an iterable."""
+        if self._source != None:
+            return None
+        if self._per_page != None:
+            return -(-len(self._items) // self._per_page)
+        while self._page_range(len(self._starts) - 1):
+            pass
+        return len(self._starts) - 1
+
+    def _known_page_count(self):
+        """Returns how many pages there are if that is known without
+        measuring any more items, or None."""
+        if self._per_page != None or self._starts[-1] == len(self._items):
+            return self.page_count()
+        return None
+
+    def _materialize(self):
+        """Makes widgets for the items in the window around the current
+        page, recycling those of items that have left it."""
+        wanted = set()
+        for page in range(max(self.current_page - self.window, 0),
+                          self.current_page + self.window + 1):
+            page_range = self._page_range(page)
+            if page_range:
+                wanted.update(range(*page_range))
+
+        for index in [index for index in self._shown if index not in wanted]:
+            widget = self._widgets.pop(index)
+            del self._index_of[widget]
+            del self._shown[bisect_left(self._shown, index)]
+            self.remove(widget)
+            self._recycled.append(widget)
+
+        for index in sorted(wanted.difference(self._widgets)):
+            recycled = self._recycled and self._recycled.pop() or None
+            widget = self.factory(self._items[index], recycled)
+            self._widgets[index] = widget
+            self._index_of[widget] = index
+
+            position = bisect_left(self._shown, index)
+            self._shown.insert(position, index)
+            self.add(widget, position)
+
+    def _arrange(self, x, y, width, height, owner):
+        for index in self._shown:
+            start = self._page_range(self._page_of_item(index))[0]
+            self._widgets[index].arrange(x, y + self._offset(index) -
+                                         self._offset(start),
+                                         width, height, self)
+
+    def shows(self, control):
+        try:
+            index = self._index_of[control]
+        except KeyError:
+            return False
+        return self._page_of_item(index) == self.current_page
+
+    def _turn_to(self, page, focus_last=False):
+        self.current_page = page
+        self._materialize()
+        self.owner.dirty = True
+
+        start, end = self._page_range(page)
+        if not self.shows(self.owner.focused_control):
+            self.owner.focus(self._widgets[focus_last and end - 1 or start])
+
+    def next_page(self, count=1):
+        page = self.current_page + count
+        while page > self.current_page and not self._page_range(page):
+            page -= 1
+        if page != self.current_page:
+            self._turn_to(page)
+
+    def prev_page(self, count=1):
+        page = max(self.current_page - count, 0)
+        if page != self.current_page:
+            self._turn_to(page, focus_last=True)
+
+    def draw_contents(self, drawer):
+        if self.owner.focused_control in self._index_of:
+            drawer.rectangle(self.x + 1, self.y + 1,
+                             self.width + self.x - 2,
+                             self.height + self.y - 1)
+
+        start, end = self._page_range(self.current_page) or (0, 0)
+        for index in range(start, end):
+            child = self._widgets[index]
+            try:
+                child.render(drawer)
+            except AttributeError:
+                child.draw_contents(drawer)
+
+        # counting the pages of items of different heights means
+        # measuring them all, so that waits until they have been paged
+        # through
+        pages = self._known_page_count()
+        if pages == None:
+            message = "(Page %s)" % (self.current_page + 1)
+        else:
+            message = "(Page %s of %s)" % (self.current_page + 1, pages)
+
+        x_offset = chars_to_pixels(len(message) + 1)
+        
+        drawer.text(self.width - x_offset, self.max_height, message)
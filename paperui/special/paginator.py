@@ -2,21 +2,49 @@ from PIL import Image, ImageFont, ImageDraw
 from enums import enum
 from paperui import ui
 from paperui.core import *
-from threading import Thread
+from threading import Thread, Condition, Lock
+from collections import OrderedDict
+from itertools import accumulate
+from bisect import bisect_right
+from array import array
+import mmap
+import os
+from paperui.text_wrapper import common_prefix
 import math
 
 orientations = enum(landscape=0,
                     portrait=1)
 
+# bytes that are not UTF-8 decode with surrogateescape to one of these,
+# which is shown as a replacement character
+_escaped_bytes = dict((code, "\ufffd") for code in range(0xdc80, 0xdd00))
+
+def byte_offsets(line, offsets):
+    """Returns the UTF-8 byte offsets of ascending character offsets
+    into a line decoded with surrogateescape, encoding each stretch
+    between them once."""
+    byte_offset = char_offset = 0
+    result = []
+    for offset in offsets:
+        byte_offset += len(line[char_offset:offset].encode("utf-8",
+                                                           "surrogateescape"))
+        char_offset = offset
+        result.append(byte_offset)
+    return result
+
 class Line(object):
-    def __init__(self, text, size):
+    def __init__(self, text, size, start=0, end=0):
         self.text = text
         self.size = size
+        self.start = start
+        self.end = end
 
 class Page(list):
-    def __init__(self, size):
+    def __init__(self, size, start=0):
         list.__init__(self)
         self.size = size
+        self.start = start
+        self.end = None
         if self.size[0] < self.size[1]:
             self.orientation = orientations.portrait
         else:
@@ -48,14 +76,145 @@ def max_char_width(font):
 
     return max_width
 
+class FontMetrics(object):
+    """Advance widths for one font: a table of single characters, and
+    a bounded cache of whole words built from it."""
+    def __init__(self, font, word_cache_size=4096):
+        self.font = font
+        self.word_cache_size = word_cache_size
+        self._advances = {}
+        self._words = OrderedDict()
+    def advance(self, char):
+        try:
+            return self._advances[char]
+        except KeyError:
+            try:
+                width = self.font.getlength(char)
+            except AttributeError:
+                # older Pillow; the width of the ink box instead
+                width = self.font.getsize(char)[0]
+            self._advances[char] = width
+            return width
+    def word_width(self, word):
+        try:
+            self._words.move_to_end(word)
+            return self._words[word]
+        except KeyError:
+            width = sum([self.advance(c) for c in word])
+            self._words[word] = width
+            if len(self._words) > self.word_cache_size:
+                self._words.popitem(last=False)
+            return width
+
+_font_metrics = OrderedDict()
+font_metrics_cache_size = 16
+
+def font_metrics(font):
+    """Returns the shared FontMetrics for a font, keeping those of the
+    last `font_metrics_cache_size` fonts asked for."""
+    key = (getattr(font, "path", id(font)), getattr(font, "size", None))
+    try:
+        _font_metrics.move_to_end(key)
+        return _font_metrics[key]
+    except KeyError:
+        metrics = _font_metrics[key] = FontMetrics(font)
+        if len(_font_metrics) > font_metrics_cache_size:
+            _font_metrics.popitem(last=False)
+        return metrics
+
+class MappedText(object):
+    """A UTF-8 text file mapped into memory rather than read, for
+    paginating files too big to hold as a string.  It is indexed by
+    byte offset, and slices are bytes; a Paginator decodes each line as
+    it wraps it, so page offsets into a MappedText are byte offsets."""
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            self._data = b""
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def find(self, sub, start=0, end=None):
+        if isinstance(sub, str):
+            sub = sub.encode("utf-8")
+        if end == None:
+            end = len(self._data)
+        return self._data.find(sub, start, end)
+
+    def fingerprint(self):
+        """Returns bytes that change whenever the file does, to key a
+        PageIndex by instead of hashing the whole file."""
+        stat = os.stat(self.path)
+        return repr((os.path.realpath(self.path),
+                     stat.st_size, stat.st_mtime_ns)).encode("utf-8")
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+class PageList(object):
+    """The pages of a text, kept as an array of the offsets at which
+    each begins.  Pages are wrapped again from the text when asked for,
+    and only the last `cache_size` of them are kept."""
+    def __init__(self, paginator, text, starts=(), end=0, cache_size=8):
+        self.paginator = paginator
+        self.text = text
+        self.starts = array("I", starts)
+        self.end = end
+        self.cache_size = cache_size
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.starts)
+        if not 0 <= index < len(self.starts):
+            raise IndexError("page index out of range")
+
+        try:
+            self._pages.move_to_end(index)
+            return self._pages[index]
+        except KeyError:
+            if index + 1 < len(self.starts):
+                end = self.starts[index + 1]
+            else:
+                end = self.end
+            page = self.paginator.page_between(self.text,
+                                               self.starts[index], end)
+            self._remember(index, page)
+            return page
+
+    def _remember(self, index, page):
+        self._pages[index] = page
+        while len(self._pages) > self.cache_size:
+            self._pages.popitem(last=False)
+
+    def append(self, page):
+        self.starts.append(page.start)
+        self.end = page.end
+        self._remember(len(self.starts) - 1, page)
+
 class Paginator(object):
-    def __init__(self, font, size, margin=20):
+    def __init__(self, font, size, margin=20, index=None):
         self.font = font
+        self.metrics = font_metrics(font)
         self.max_char_width = max_char_width(self.font)
         self.size = size
         self.pages = []
-        self.page = Page(self.size)
         self.margin = margin
+        self.index = index
         self.finished = False
     def wrap(self, line):
         max_width = self._page_size()[0] - self.margin * 2
@@ -66,81 +225,328 @@ class Paginator(object):
             words = line.strip().split(" ")
         else:
             words = [" "]
-        
-        acc = []
-        lastsize, newsize = (0, 0), (0, 0)
-
-        for word in words:
-            # if the line would fit if all characters were as big as
-            # the widest, just add the word
-            if len(" ".join(acc + [word])) < math.floor(self.size[0] / self.max_char_width):
-                acc.append(word)
-            else:
-                # otherwise, test for fit
-                newsize = self.font.getsize(" ".join(acc + [word]))
-                if newsize[0] > max_width:
-                    offsets = self.font.getoffset(" ".join(acc))
-                    lastsize = (lastsize[0], lastsize[1] + offsets[1])
-                    lines.append(Line(" ".join(acc), lastsize))
-                    acc = [word]
-                    lastsize, newsize = (0,0), (0,0)
-                else:
-                    acc.append(word)
-                    lastsize = newsize
 
-        if acc: # if there is a partial line left
-            lines.append(Line(" ".join(acc),
-                              self.font.getsize(" ".join(acc))))
+        # edges[i] is the width of the first i words, each followed
+        # by a space, so words i to j-1 fit on a line when
+        # edges[j] - edges[i] - space <= max_width
+        space = self.metrics.advance(" ")
+        edges = [0] + list(accumulate([self.metrics.word_width(word) + space
+                                       for word in words]))
+
+        # where each word begins in line
+        offsets = list(accumulate([len(line) - len(line.lstrip())] +
+                                  [len(word) + 1 for word in words]))
+
+        start = 0
+        while start < len(words):
+            end = bisect_right(edges, edges[start] + space + max_width,
+                               lo=start + 1) - 1
+            end = max(end, start + 1)
+
+            # the advance widths ignore kerning, so FreeType has the
+            # last word on whether the line really fits
+            text = " ".join(words[start:end])
+            size = self.font.getsize(text)
+            while size[0] > max_width and end > start + 1:
+                end -= 1
+                text = " ".join(words[start:end])
+                size = self.font.getsize(text)
+
+            lines.append(Line(text, size,
+                              offsets[start],
+                              min(offsets[end] - 1, len(line))))
+            start = end
 
         return lines
 
-    def _new_page(self):
-        self.page = Page(self._page_size())
-
     def _page_size(self):
         return (math.floor(self.size[0] - line_width * 2),
                 math.floor(self.size[1] - line_width * 2))
 
-    def paginate(self, text):
-        self._new_page()
-        self.finished = False
-        
+    def layout(self):
+        """Returns everything besides the text that decides where the
+        pages break."""
+        return (getattr(self.font, "path", None),
+                getattr(self.font, "size", None),
+                tuple(self._page_size()),
+                self.margin)
+
+    def iter_pages(self, text, start=0, end=None):
+        """Yields the pages of text[start:end] one at a time, as soon
+        as each is full.  start must be the start of a line of text,
+        such as where an earlier page began."""
+        if end == None:
+            end = len(text)
+
+        page = Page(self._page_size(), start)
         y = 0
 
-        for line in text.split("\n"):
-            for row in self.wrap(line):
-                text, size = row.text, row.size
-                if y + size[1] > self._page_size()[1]:
-                    self.pages.append(self.page)
-                    self._new_page()
-                    self.page.append(row)
-                    y = size[1]
+        while True:
+            newline = text.find("\n", start, end)
+            if newline == -1:
+                line_end = end
+            else:
+                line_end = newline
+
+            line = text[start:line_end]
+            decoded = None
+            if isinstance(line, bytes):
+                try:
+                    decoded = line.decode("utf-8")
+                    line = decoded
+                except UnicodeDecodeError:
+                    # one character per bad byte keeps the offsets right
+                    decoded = line.decode("utf-8", "surrogateescape")
+                    line = decoded.translate(_escaped_bytes)
+
+            rows = self.wrap(line)
+            if decoded != None and line_end - start != len(line):
+                # offsets into a MappedText are in bytes; rows end no
+                # later than the next begins, so they ascend
+                offsets = byte_offsets(decoded,
+                                       [offset for row in rows
+                                        for offset in (row.start, row.end)])
+                for i in range(len(rows)):
+                    rows[i].start, rows[i].end = offsets[2 * i:2 * i + 2]
+
+            for row in rows:
+                row.start += start
+                row.end += start
+                if y + row.size[1] > self._page_size()[1]:
+                    page.end = row.start
+                    yield page
+                    page = Page(self._page_size(), row.start)
+                    page.append(row)
+                    y = row.size[1]
                 else:
-                    y += size[1]
-                    self.page.append(row)
+                    y += row.size[1]
+                    page.append(row)
+
+            if newline == -1:
+                break
+            start = newline + 1
+
+        if page.to_string():
+            page.end = end
+            yield page
+
+    def page_between(self, text, start, end):
+        """Wraps the page found earlier between two offsets."""
+        # a page ending at a paragraph would otherwise gain a row for
+        # the empty line after the newline, which is on the next page
+        # unless it is the last line of the text
+        stop = end
+        if (start < end < len(text) and
+                text[end - 1:end] in ("\n", b"\n")):
+            stop = end - 1
+        for page in self.iter_pages(text, start, stop):
+            page.end = end
+            return page
+        return Page(self._page_size(), start)
+
+    def paginate(self, text):
+        self.finished = False
+
+        stored = self.index and self.index.load(text, self.layout())
+        if stored:
+            starts, end, finished = stored
+            self.pages = PageList(self, text, starts, end)
+        else:
+            self.pages = PageList(self, text)
+            finished = False
+
+        if not finished:
+            for page in self.iter_pages(text, self.pages.end):
+                self.pages.append(page)
 
-        if self.page.to_string():
-            self.pages.append(self.page)
+            if self.index:
+                self.index.save(text, self.layout(),
+                                self.pages.starts, self.pages.end, True)
 
         self.finished = True
 
 class PaginatorWidget(Paginator, ui.Widget):
-    def __init__(self, font, name=None, text="", rows=3, margin=20):
+    """Shows text a page at a time.  Pages are made by a background
+    thread that stays `lookahead` pages ahead of the one shown; until
+    the page being shown exists, a placeholder is drawn instead.
+
+    The last `page_cache_size` page images are kept, and turning a
+    page renders its neighbours in the background, so that a page
+    turn is usually a single paste.
+
+    Given a PageIndex, such as paperui.special.page_index.default_index,
+    the page breaks of a text are saved to it once they have all been
+    found, or as far as they go when the widget is closed, so that
+    reopening the text picks up where pagination left off.  When the
+    text changes, the pages before the first changed paragraph are
+    kept.
+
+    """
+    def __init__(self, font, name=None, text="", rows=3, margin=20, lookahead=2,
+                 page_cache_size=5, index=None):
         height = math.floor(ui.char_height * rows + ui.line_width * 2)
         width = 800
 
-        Paginator.__init__(self, font, [width, height], margin)
+        Paginator.__init__(self, font, [width, height], margin, index)
         ui.Widget.__init__(self, name=name)
 
         self.size = [width, height]
+        self.lookahead = lookahead
+
+        self._pagination = Condition()
+        self._generation = 0
+        self._pages_wanted = 0
+        self._to_last_page = False
+
+        self.page_cache_size = page_cache_size
+        self._page_images = OrderedDict()
+        self._page_images_lock = Lock()
+
+        self._paginated = (None, None)
         self._text = ""
         self.text = text
 
+    def _reusable_pages(self, text, layout):
+        """Returns the pages already known for text, and the offset to
+        carry on paginating from, or None if they are complete."""
+        stored = self.index and self.index.load(text, layout)
+        if stored:
+            starts, end, finished = stored
+            if finished:
+                return PageList(self, text, starts, end), None
+            return PageList(self, text, starts, end), end
+
+        old_text, old_layout = self._paginated
+        if (old_layout == layout and len(self.pages) and
+                isinstance(text, str) and isinstance(old_text, str)):
+            changed = common_prefix(old_text, text)
+            paragraph = text.rfind("\n", 0, changed) + 1
+
+            # keep the pages that end before the changed paragraph
+            kept = max(bisect_right(self.pages.starts, paragraph) - 1, 0)
+            if kept:
+                pages = PageList(self, text,
+                                 self.pages.starts[:kept],
+                                 self.pages.starts[kept])
+                return pages, pages.end
+
+        return PageList(self, text), 0
+
     def begin_pagination(self):
-        paginate_thread = Thread(target=self.paginate,
-                                 args=[self._text],
+        text, layout = self._text, self.layout()
+
+        with self._pagination:
+            self._generation += 1
+            self.pages, resume_at = self._reusable_pages(text, layout)
+            self._paginated = (text, layout)
+            self.finished = resume_at is None
+            self._pages_wanted = self.page_index + 1 + self.lookahead
+            self._pagination.notify_all()
+
+        if resume_at is not None:
+            paginate_thread = Thread(target=self._paginate,
+                                     args=[self._generation, text, resume_at],
+                                     daemon=True)
+            paginate_thread.start()
+
+    def _save_index(self, generation, text, finished):
+        if not self.index:
+            return
+
+        with self._pagination:
+            if generation != self._generation:
+                return
+            starts, end = self.pages.starts[:], self.pages.end
+
+        self.index.save(text, self.layout(), starts, end, finished)
+
+    def _paginate(self, generation, text, start):
+        for page in self.iter_pages(text, start):
+            with self._pagination:
+                while (generation == self._generation and
+                       len(self.pages) >= self._pages_wanted):
+                    self._pagination.wait()
+
+                if generation != self._generation:
+                    return
+
+                self.pages.append(page)
+                arrived = (len(self.pages) - 1 == self.page_index and
+                           not self._to_last_page)
+
+            if arrived:
+                self._request_redraw()
+
+        with self._pagination:
+            if generation != self._generation:
+                return
+
+            self.finished = True
+            if self._to_last_page or self.page_index >= len(self.pages):
+                self._to_last_page = False
+                self.page_index = max(len(self.pages) - 1, 0)
+
+        self._save_index(generation, text, True)
+        self._request_redraw()
+
+    def close(self):
+        """Stops paginating, saving the page breaks found so far."""
+        if not self.finished:
+            self._save_index(self._generation, self._text, False)
+        with self._pagination:
+            self._generation += 1
+            self._pagination.notify_all()
+
+    def _want_pages(self, count):
+        with self._pagination:
+            if count > self._pages_wanted:
+                self._pages_wanted = count
+                self._pagination.notify_all()
+
+    def _request_redraw(self):
+        if self.owner:
+            self.redraw()
+
+    def page_image(self, index):
+        """Returns the rendered image of a page, from the cache if it
+        is there."""
+        with self._pagination:
+            page = self.pages[index]
+            key = (self._generation, index,
+                   getattr(self.font, "path", id(self.font)),
+                   getattr(self.font, "size", None),
+                   tuple(self.size), self.margin)
+
+        with self._page_images_lock:
+            try:
+                self._page_images.move_to_end(key)
+                return self._page_images[key]
+            except KeyError:
+                pass
+
+        image = page.to_image(font=self.font, margin=self.margin)
+
+        with self._page_images_lock:
+            self._page_images[key] = image
+            while len(self._page_images) > self.page_cache_size:
+                self._page_images.popitem(last=False)
+
+        return image
+
+    def prefetch(self, indexes):
+        """Renders pages into the cache on a background thread."""
+        prefetch_thread = Thread(target=self._prefetch,
+                                 args=[indexes],
                                  daemon=True)
-        paginate_thread.start()
+        prefetch_thread.start()
+
+    def _prefetch(self, indexes):
+        for index in indexes:
+            try:
+                if index >= 0:
+                    self.page_image(index)
+            except IndexError:
+                pass
 
     @property
     def text(self):
@@ -168,63 +574,78 @@ class PaginatorWidget(Paginator, ui.Widget):
 
     @height.setter
     def height(self, value):
-        self.size[1] = value
+        if value != self.size[1]:
+            self.size[1] = value
+            self.invalidate_layout()
 
-    def prev_page(self):
+    def prev_page(self, count=1):
+        self._to_last_page = False
         if self.page_index > 0:
-            self.page_index -= 1
+            self.page_index = max(self.page_index - count, 0)
+            self.prefetch([self.page_index - 1])
             self.redraw()
 
-    def next_page(self):
-        if self.page_index < len(self.pages) - 1:
-            self.page_index += 1
+    def next_page(self, count=1):
+        self._to_last_page = False
+        if self.page_index < len(self.pages) - 1 or not self.finished:
+            self.page_index += count
+            if self.finished:
+                self.page_index = min(self.page_index, len(self.pages) - 1)
+            self._want_pages(self.page_index + 1 + self.lookahead)
+            self.prefetch([self.page_index + 1])
             self.redraw()
 
-    def first_page(self):
+    def first_page(self, count=1):
+        self._to_last_page = False
         self.page_index = 0
         self.redraw()
 
-    def last_page(self):
-        self.page_index = len(self.pages) - 1
+    def last_page(self, count=1):
+        if self.finished:
+            self.page_index = len(self.pages) - 1
+        else:
+            self._to_last_page = True
+            self._want_pages(float("inf"))
         self.redraw()
         
-    def handle_key(self, char, code):
-        if code == "KEY_LEFT":
-            self.prev_page()
-        elif code == "KEY_RIGHT":
-            self.next_page()
-        elif code in ["C-KEY_LEFT", "KEY_HOME", "C-KEY_HOME"]:
-            self.first_page()
-        elif code in ["C-KEY_RIGHT", "KEY_END", "C-KEY_END"]:
-            self.last_page()
+    bindings = {
+        "KEY_LEFT": "prev_page",
+        "KEY_RIGHT": "next_page",
+        "C-KEY_LEFT": "first_page",
+        "KEY_HOME": "first_page",
+        "C-KEY_HOME": "first_page",
+        "C-KEY_RIGHT": "last_page",
+        "KEY_END": "last_page",
+        "C-KEY_END": "last_page"
+    }
         
     def draw(self, drawer):
         self.draw_outline(drawer)
-        
-        while len(self.pages) <= self.page_index:
-            pass
 
         try:
-
-            page_image = self.pages[self.page_index].to_image(
-                font=self.font,
-                margin=self.margin)
-
-            drawer.image(math.floor(self.x + line_width),
-                         math.floor(self.y + line_width),
-                         page_image)
-
+            if self._to_last_page:
+                raise IndexError
+            page_image = self.page_image(self.page_index)
         except IndexError:
-            pass
+            # not paginated that far yet; the pagination thread
+            # redraws when the page arrives
+            drawer.text(self.x + line_width + self.margin,
+                        self.y + line_width,
+                        "Paginating...")
+            return
+
+        drawer.image(math.floor(self.x + line_width),
+                     math.floor(self.y + line_width),
+                     page_image)
 
 
 if __name__ == "__main__":
-    import sys, codecs
+    import sys
     from fontlist import FontList
     
     fonts = FontList.all().by_partial_name("dejavu serif").regular()
     font = ImageFont.truetype(fonts[1]["path"])
     paginator = Paginator(font, (800, 480))
-    text = codecs.open(sys.argv[1], "r", "utf-8").read()
+    text = MappedText(sys.argv[1])
     paginator.paginate(text)
     print(len(paginator.pages))
@@ -0,0 +1,211 @@
+from bisect import bisect_left, bisect_right
+
+word_chars = frozenset("abcdefghijklmnopqrstuvwxyz"
+                       "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+                       "0123456789")
+
+class TextBuffer(object):
+    """Editable text kept as a gap buffer.
+
+    The characters before the gap are held in one list and those after
+    it in another, reversed, so inserting or deleting at the gap is an
+    append or a pop; the gap only moves when an edit happens somewhere
+    else.  The positions of newlines are indexed the same way, which
+    keeps the index valid across edits without renumbering it.
+
+    It can stand in for the string it holds where a TextWrapper reads
+    it: it has len(), indexes and slices, and find and rfind for
+    newlines, so the text never needs joining.  `revision` counts the
+    edits, and `take_changes()` says which part of the text the edits
+    since it was last called may have touched.
+
+    """
+    def __init__(self, text=""):
+        self._before = list(text)
+        self._after = []
+        self._newlines_before = [i for i in range(len(text))
+                                 if text[i] == "\n"]
+        # indexes into _after, so ascending here is descending in the text
+        self._newlines_after = []
+        self._text = text
+
+        self.revision = 0
+        self._changed_at = None
+        self._unchanged_tail = None
+
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(*index.indices(len(self))[:2])
+        if index < 0:
+            index += len(self)
+        if index < len(self._before):
+            return self._before[index]
+        return self._after[len(self) - 1 - index]
+
+    def _slice(self, start, end):
+        if end <= start:
+            return ""
+        split = len(self._before)
+        if end <= split:
+            return "".join(self._before[start:end])
+        after = len(self._after)
+        tail = "".join(reversed(self._after[max(after - (end - split), 0):
+                                            after - max(start - split, 0)]))
+        if start >= split:
+            return tail
+        return "".join(self._before[start:]) + tail
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ("".join(self._before) +
+                          "".join(reversed(self._after)))
+        return self._text
+
+    def _move_gap(self, pos):
+        length = len(self)
+
+        if pos < len(self._before):
+            moved = self._before[pos:]
+            del self._before[pos:]
+            self._after.extend(reversed(moved))
+
+            split = bisect_left(self._newlines_before, pos)
+            moved_newlines = self._newlines_before[split:]
+            del self._newlines_before[split:]
+            self._newlines_after.extend([length - 1 - i
+                                         for i in reversed(moved_newlines)])
+
+        elif pos > len(self._before):
+            count = pos - len(self._before)
+            moved = self._after[-count:]
+            del self._after[-count:]
+            self._before.extend(reversed(moved))
+
+            split = bisect_left(self._newlines_after, len(self._after))
+            moved_newlines = self._newlines_after[split:]
+            del self._newlines_after[split:]
+            self._newlines_before.extend([length - 1 - j
+                                          for j in reversed(moved_newlines)])
+
+    def insert(self, pos, text):
+        self._move_gap(pos)
+        for i in range(len(text)):
+            if text[i] == "\n":
+                self._newlines_before.append(pos + i)
+        self._before.extend(text)
+        self._text = None
+        self._changed(pos, len(self) - pos - len(text))
+
+    def delete(self, pos, count=1):
+        """Deletes up to count characters starting at pos."""
+        count = min(count, len(self) - pos)
+        if count <= 0:
+            return
+        self._move_gap(pos)
+        del self._after[-count:]
+        while (self._newlines_after and
+               self._newlines_after[-1] >= len(self._after)):
+            self._newlines_after.pop()
+        self._text = None
+        self._changed(pos, len(self) - pos)
+
+    def _changed(self, pos, unchanged_tail):
+        self.revision += 1
+        if self._changed_at == None:
+            self._changed_at = pos
+            self._unchanged_tail = unchanged_tail
+        else:
+            self._changed_at = min(self._changed_at, pos)
+            self._unchanged_tail = min(self._unchanged_tail, unchanged_tail)
+
+    def take_changes(self):
+        """Returns (changed_at, unchanged_tail) for the edits since the
+        last call: the text before changed_at and its last
+        unchanged_tail characters are as they were.  Returns None if
+        there have been no edits."""
+        changes = self._changed_at, self._unchanged_tail
+        self._changed_at = self._unchanged_tail = None
+        if changes[0] == None:
+            return None
+        return changes
+
+    def newlines(self):
+        """Returns the positions of all newlines, in order."""
+        length = len(self)
+        return (self._newlines_before +
+                [length - 1 - j for j in reversed(self._newlines_after)])
+
+    def line_start(self, pos):
+        """Returns the position of the first character on the line
+        containing pos."""
+        length = len(self)
+        if pos > len(self._before):
+            # the nearest newline before pos in the after part has the
+            # smallest index greater than that of pos
+            i = bisect_right(self._newlines_after, length - 1 - pos)
+            if i < len(self._newlines_after):
+                return length - self._newlines_after[i]
+            pos = len(self._before)
+        i = bisect_left(self._newlines_before, pos)
+        if i:
+            return self._newlines_before[i - 1] + 1
+        return 0
+
+    def line_end(self, pos):
+        """Returns the position of the newline ending the line
+        containing pos, or the length of the text on the last line."""
+        length = len(self)
+        if pos < len(self._before):
+            i = bisect_left(self._newlines_before, pos)
+            if i < len(self._newlines_before):
+                return self._newlines_before[i]
+            pos = len(self._before)
+        i = bisect_right(self._newlines_after, length - 1 - pos)
+        if i:
+            return length - 1 - self._newlines_after[i - 1]
+        return length
+
+    def find(self, sub, start=0, end=None):
+        """Like str.find, for newlines only."""
+        if sub != "\n":
+            raise ValueError("only newlines are indexed")
+        if end == None:
+            end = len(self)
+        if start >= end:
+            return -1
+        newline = self.line_end(start)
+        if newline < end and newline < len(self):
+            return newline
+        return -1
+
+    def rfind(self, sub, start=0, end=None):
+        """Like str.rfind, for newlines only."""
+        if sub != "\n":
+            raise ValueError("only newlines are indexed")
+        if end == None:
+            end = len(self)
+        newline = self.line_start(min(end, len(self))) - 1
+        if newline >= start:
+            return newline
+        return -1
+
+    def word_start(self, pos):
+        """Returns the start of the word before pos."""
+        while pos > 0 and self[pos - 1] not in word_chars:
+            pos -= 1
+        while pos > 0 and self[pos - 1] in word_chars:
+            pos -= 1
+        return pos
+
+    def word_end(self, pos):
+        """Returns the end of the word after pos."""
+        length = len(self)
+        while pos < length and self[pos] not in word_chars:
+            pos += 1
+        while pos < length and self[pos] in word_chars:
+            pos += 1
+        return pos
@@ -1,46 +1,179 @@
+from bisect import bisect_left, bisect_right
+
+def common_prefix(a, b, chunk=1024):
+    """Returns the length of the longest common prefix of a and b,
+    comparing whole chunks at a time."""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + chunk] == b[i:i + chunk]:
+        i += chunk
+    i = min(i, n)
+    end = min(i + chunk, n)
+    while i < end and a[i] == b[i]:
+        i += 1
+    return i
+
+def common_suffix(a, b, limit, chunk=1024):
+    """Returns the length of the longest common suffix of a and b, up
+    to limit characters."""
+    i = 0
+    while i < limit:
+        step = min(chunk, limit - i)
+        if a[len(a) - i - step:len(a) - i] != b[len(b) - i - step:len(b) - i]:
+            break
+        i += step
+    while i < limit and a[len(a) - i - 1] == b[len(b) - i - 1]:
+        i += 1
+    return i
+
 class TextWrapper(object):
-    def __init__(self):
+    """Wraps text into rows of at most `width` characters, breaking
+    after spaces where possible and always at newlines.
+
+    Paragraphs wrap independently of each other, so with
+    `incremental=True` the wrapper keeps its last result and, when
+    called again on edited text, re-wraps only from the paragraph
+    containing the first change until the row starts line up with the
+    old ones again.  Where the edits were made is found by comparing
+    the old text with the new, unless the caller says, as TextEdit
+    does by passing its TextBuffer and the buffer's changes.
+
+    """
+    def __init__(self, incremental=False):
         self._wrap_chars = " "
+        self.incremental = incremental
         self.unwrapped = ""
+        self.length = 0
+        self.width = None
         self.cursor_loc = [0, 0]
-        self.prev_line_break = 0
         self.rows = []
-    def add_line(self, end):
-
-        new_line = self.unwrapped[self.prev_line_break:end].replace("\n", " ")
-        self.rows.append(new_line)
-        
-        if 0 <= self.chars_to_cursor <= len(new_line):
-            self.cursor_loc[0] = len(self.rows) - 1
-            self.cursor_loc[1] = self.chars_to_cursor
+        self.row_starts = []
 
-        self.chars_to_cursor -= len(new_line)
+    def _wrap_paragraph(self, s, start, width):
+        """Returns the row starts of the paragraph beginning at start,
+        where the next paragraph begins, and whether this was the last
+        paragraph."""
+        end = s.find("\n", start)
+        last = end == -1
+        if last:
+            end = len(s)
+        else:
+            end += 1
 
-        self.prev_line_break = end
+        starts = [start]
+        prev_line_break = start
+        maybe_break_at = start
 
-    def wrap(self, s, cursor_pos, width=80):
-        self.unwrapped = s
-        self.cursor_loc = [0, 0]
-        self.prev_line_break = 0
-        self.rows = []
-        
-        maybe_break_at = 0
-        
-        self.chars_to_cursor = cursor_pos
-        
-        for i in range(len(s)):
-
-            if s[i] == "\n":
-                self.add_line(i+1)
-            elif i - self.prev_line_break == width:
-                if maybe_break_at <= self.prev_line_break:
-                    self.add_line(i)
+        # one slice, so that s need not be a str
+        paragraph = s[start:end]
+        for i in range(start, end):
+            c = paragraph[i - start]
+            if c == "\n":
+                break
+            elif i - prev_line_break == width:
+                if maybe_break_at <= prev_line_break:
+                    prev_line_break = i
                 else:
-                    self.add_line(maybe_break_at)
-            else:
-                if s[i] in self._wrap_chars:
-                    maybe_break_at = i + 1
-        self.add_line(len(s))
+                    prev_line_break = maybe_break_at
+                starts.append(prev_line_break)
+            elif c in self._wrap_chars:
+                maybe_break_at = i + 1
+
+        return starts, end, last
+
+    def _wrap_from(self, s, start, width, old_length=None, old_starts=None, resync_after=None):
+        """Wraps s from the paragraph beginning at start.  Given the
+        length of the old text and its row starts, stops at the first
+        paragraph beyond resync_after, returning the index of the old
+        row it matches so the rest can be reused."""
+        starts = []
+        if old_length is not None:
+            delta = len(s) - old_length
+
+        while True:
+            paragraph, start, last = self._wrap_paragraph(s, start, width)
+            starts.extend(paragraph)
+            if last:
+                return starts, None
+            # the newline ending this paragraph is in the unchanged
+            # tail, so an old paragraph began at the same place
+            if old_length is not None and start > resync_after:
+                return starts, bisect_left(old_starts, start - delta)
+
+    def _row(self, s, starts, index):
+        try:
+            end = starts[index + 1]
+        except IndexError:
+            end = len(s)
+        return s[starts[index]:end].replace("\n", " ")
+
+    def _full_wrap(self, s, width):
+        starts, _ = self._wrap_from(s, 0, width)
+        self.row_starts = starts
+        self.rows = [self._row(s, starts, i) for i in range(len(starts))]
+
+    def _rewrap(self, s, width, changes=None):
+        old_length, old_starts, old_rows = self.length, self.row_starts, self.rows
+
+        if changes is None:
+            old = self.unwrapped
+            changed_at = common_prefix(old, s)
+            if changed_at == len(old) == len(s):
+                return
+
+            unchanged_tail = common_suffix(old, s,
+                                            min(len(old), len(s)) - changed_at)
+        else:
+            changed_at, unchanged_tail = changes
+            unchanged_tail = min(unchanged_tail,
+                                 min(old_length, len(s)) - changed_at)
+
+        # rows before the edited paragraph are untouched
+        paragraph_start = s.rfind("\n", 0, changed_at) + 1
+        first_row = bisect_left(old_starts, paragraph_start)
+
+        starts, resync_row = self._wrap_from(s, paragraph_start, width,
+                                             old_length, old_starts,
+                                             len(s) - unchanged_tail)
+
+        if resync_row is None:
+            tail_starts, tail_rows = [], []
+        else:
+            delta = len(s) - old_length
+            tail_starts = [start + delta for start in old_starts[resync_row:]]
+            tail_rows = old_rows[resync_row:]
+
+        all_starts = old_starts[:first_row] + starts + tail_starts
+        self.rows = (old_rows[:first_row] +
+                     [self._row(s, all_starts, first_row + i)
+                      for i in range(len(starts))] +
+                     tail_rows)
+        self.row_starts = all_starts
+
+    def locate(self, cursor_pos):
+        """Returns the (row, column) of a position in the last wrapped
+        text."""
+        if not 0 <= cursor_pos <= self.length:
+            return 0, 0
+        row = bisect_right(self.row_starts, cursor_pos) - 1
+        return row, cursor_pos - self.row_starts[row]
+
+    def wrap(self, s, cursor_pos, width=80, changes=None):
+        """Wraps s, which is a str or a TextBuffer.  When it is the
+        same TextBuffer as last time, `changes` should be what its
+        take_changes() returned, as the old text is not kept to
+        compare against."""
+        if self.incremental and self.rows and width == self.width:
+            self._rewrap(s, width, changes)
+        else:
+            self._full_wrap(s, width)
+
+        if isinstance(s, str):
+            self.unwrapped = s
+        self.length = len(s)
+        self.width = width
+        self.cursor_loc = list(self.locate(cursor_pos))
+
         return self.rows, self.cursor_loc[0], self.cursor_loc[1]
 
 if __name__ == "__main__":
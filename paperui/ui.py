@@ -1,12 +1,20 @@
 import math
+import asyncio
+from bisect import bisect_left
+from inspect import isawaitable
 from datetime import date, datetime
-from threading import Thread
+from threading import Thread, Condition
 
 from paperui.key_events import ExclusiveKeyReader
 from paperui.core import *
 from enums import enum
 from paperui.keyboard import KeyTranslator
+from paperui import keymap
 from paperui.text_wrapper import TextWrapper
+from paperui.text_buffer import TextBuffer
+from paperui.coalescing import AdaptiveCoalescing
+from paperui.focus import FocusRing, GridIndex
+from paperui.pipeline import DisplayPipeline
 
 align = enum(left=-1, center=0, right=1)
 
@@ -24,9 +32,40 @@ def visible_text(text, writable_length, alignment=align.left):
 class WidgetSanityError(Exception):
     pass
 
+_tasks = set()
+
+def spawn(result):
+    """Lets event handlers be coroutines: if `result` is awaitable it
+    is run as a task on the running asyncio loop, or to completion if
+    there is none."""
+    if not isawaitable(result):
+        return result
+
+    async def wait():
+        return await result
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(wait())
+
+    task = loop.create_task(wait())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
 class Connectable(object):
+    bindings = {}
+
     def __init__(self):
         self._events = {}
+    def bind(self, keys, action):
+        """Binds keys to an action for this object alone, overriding
+        the bindings of its class; see paperui.keymap."""
+        if "bindings" not in self.__dict__:
+            self.bindings = dict(self.bindings)
+        self.bindings[keys] = action
+        keymap.changed()
     def connect(self, event, action):
         try:
             self._events[event].append(action)
@@ -36,7 +75,7 @@ class Connectable(object):
         try:
             for action in self._events[event]:
                 try:
-                    action(self.owner, self, data)
+                    spawn(action(self.owner, self, data))
                 except Exception as e:
                     print(e.message)
         except KeyError:
@@ -45,7 +84,8 @@ class Connectable(object):
 class Widget(Connectable, object):
     def __init__(self, name=None):
         Connectable.__init__(self)
-        self.name = name
+        self._name = name
+        self.parent = None
         self.focused = False
         self.x = None
         self.y = None
@@ -53,6 +93,37 @@ class Widget(Connectable, object):
         self.height = line_width + char_height + line_width
         self.can_focus = True
         self.owner = None
+        self._render_key = None
+        self._rendering = None
+    @property
+    def name(self):
+        return self._name
+    @name.setter
+    def name(self, new_name):
+        old_name, self._name = self._name, new_name
+        if self.owner != None and old_name != new_name:
+            self.owner._rename(self, old_name, new_name)
+    @property
+    def height(self):
+        return self._height
+    @height.setter
+    def height(self, value):
+        if value != getattr(self, "_height", None):
+            self._height = value
+            self.invalidate_layout()
+    def invalidate_layout(self):
+        if self.parent != None:
+            self.parent.invalidate_layout()
+    def measure(self, width):
+        """Returns the height the widget needs at `width`."""
+        return self.height
+    def arrange(self, x, y, width, height, owner=None):
+        """Places the widget; `height` is the room there is below."""
+        self.x = x
+        self.y = y
+        self.owner = owner
+        if self.width != width:
+            self.width = width
     def draw_outline(self, drawer):
         drawer.rectangle(self.x + 1, self.y + 1,
                          self.width + self.x - 2,
@@ -73,10 +144,39 @@ class Widget(Connectable, object):
         drawer.text(self.x + line_width,
                     self.y + line_width,
                     text)
+    def cache_key(self):
+        """Returns a hashable summary of everything that changes how
+        the widget looks, or None to draw it afresh every frame."""
+        return None
+    def render(self, drawer):
+        """Draws the widget, reusing its last rendering if its cache
+        key has not changed since."""
+        key = self.cache_key()
+        if key is None:
+            self.draw(drawer)
+            return
+
+        key = (key, self.width, self.height, drawer)
+        if key != self._render_key:
+            self._rendering = drawer.capture(self.x, self.y,
+                                             self.width, self.height,
+                                             self.draw)
+            self._render_key = key
+
+        drawer.stamp(self.x, self.y, self._rendering)
     def redraw(self):
         self.owner.dirty = True
     def handle_key(self, char, code):
-        print("Key handler not implemented yet for %s." % type(self))
+        """Handles a key the widget has no binding for."""
+        if char:
+            return self.handle_char(char)
+        return False
+    def handle_char(self, char):
+        return False
+    def handle_key_repeat(self, char, code, count):
+        """Handles an unbound key held down for `count` repeats."""
+        for i in range(count):
+            self.handle_key(char, code)
     def text_value(self):
         try:
             return self.text
@@ -86,21 +186,58 @@ class Widget(Connectable, object):
 class Container(Connectable, object):
     def __init__(self, contents=list()):
         Connectable.__init__(self)
-        self.contents = contents
-        self.tab_order = []
+        self.contents = list(contents)
         self.owner = None
-        
+        self.parent = None
+        self.focused_control = None
+
+        # built when first needed, from the controls in contents
+        self._focus_ring = None
+        self._grid = None
+
+        # the (width, height) last measured and the placement last
+        # arranged; cleared when anything inside changes size
+        self._measured = None
+        self._arranged = None
+
         for item in self.contents:
-            try:
-                self.tab_order = self.tab_order + item.tab_order
-            except AttributeError:
-                if item.can_focus:
-                    self.tab_order.append(item)
-                    
+            item.parent = self
+
+    def widgets(self):
+        """Yields the widgets in the container and in the containers
+        inside it, depth first, but not those containers themselves."""
+        stack = [iter(self.contents)]
+        while stack:
+            for item in stack[-1]:
+                try:
+                    stack.append(iter(item.contents))
+                    break
+                except AttributeError:
+                    yield item
+            else:
+                stack.pop()
+
+    def focusable(self):
+        """Yields the controls in the container that can take focus,
+        in tab order."""
+        for item in self.widgets():
+            if item.can_focus:
+                yield item
+
+    @property
+    def focus_ring(self):
+        if self._focus_ring == None:
+            self._focus_ring = FocusRing(self.focusable())
+        return self._focus_ring
+
+    @property
+    def tab_order(self):
+        return list(self.focus_ring)
+
     def draw_contents(self, drawer):
         for child in self.contents:
             try:
-                child.draw(drawer)
+                child.render(drawer)
             except AttributeError:
                 child.draw_contents(drawer)
     def control(self, name):
@@ -113,11 +250,163 @@ class Container(Connectable, object):
                 if item.name == name:
                     return item
         return None
-    
+
+    def controls(self, name):
+        """Returns every widget called `name`."""
+        return [item for item in self.widgets() if item.name == name]
+
+    def _rename(self, widget, old_name, new_name):
+        if self.owner != None and self.owner is not self:
+            self.owner._rename(widget, old_name, new_name)
+
+    def shows(self, control):
+        """Returns whether a control in the container is on screen."""
+        return True
+
+    def measure(self, width):
+        """Returns the height the container needs at `width`, only
+        measuring its children again if something in it has changed."""
+        if self._measured == None or self._measured[0] != width:
+            self._measured = (width, self._measure(width))
+        return self._measured[1]
+
+    def _measure(self, width):
+        return self.height
+
+    def arrange(self, x, y, width, height, owner=None):
+        """Places the container and its contents, unless they are
+        already placed there and nothing in them has changed."""
+        placement = (x, y, width, height, owner)
+        if placement == self._arranged:
+            return
+        self.x = x
+        self.y = y
+        self.owner = owner
+        self.width = width
+        self.height = self.measure(width)
+        self._arrange(x, y, width, height, owner)
+        self._arranged = placement
+
+    def _arrange(self, x, y, width, height, owner):
+        pass
+
+    def do_layout(self, x, y, width, height, owner=None):
+        self.arrange(x, y, width, height, owner)
+
+    def invalidate_layout(self):
+        """Forgets the layout of the container and those above it, to
+        be redone before the next draw."""
+        if self._measured == None and self._arranged == None:
+            # already waiting for layout, as are those above
+            return
+        self._measured = None
+        self._arranged = None
+        self._grid = None
+        if self.parent != None:
+            self.parent.invalidate_layout()
+
+    def _owner_for(self, item):
+        """Returns the owner that arranging the container gives its
+        items."""
+        return self.owner
+
+    def _register(self, item):
+        pass
+
+    def _unregister(self, item):
+        pass
+
+    def _ancestors(self):
+        container = self
+        while container != None:
+            yield container
+            container = container.parent
+
+    def add(self, item, index=None):
+        """Adds an item to the container at runtime, at `index` or at
+        the end, updating the tab order of the containers above it.
+        Only the containers above it are laid out again."""
+        if index == None:
+            index = len(self.contents)
+        self.contents = (self.contents[:index] + [item] +
+                         self.contents[index:])
+        item.parent = self
+        item.owner = self._owner_for(item)
+        self.invalidate_layout()
+
+        try:
+            controls = list(item.focusable())
+        except AttributeError:
+            controls = item.can_focus and [item] or []
+
+        # the last control that can take focus before the item, and
+        # the container it was found in; rings below that container
+        # get the new controls at their start
+        preceding, found_in = None, None
+        child = item
+        for container in self._ancestors():
+            position = container.contents.index(child)
+            for sibling in reversed(container.contents[:position]):
+                try:
+                    last = None
+                    for last in sibling.focusable():
+                        pass
+                except AttributeError:
+                    last = sibling.can_focus and sibling or None
+                if last != None:
+                    preceding, found_in = last, container
+                    break
+            if preceding != None:
+                break
+            child = container
+
+        anchor = None
+        for container in self._ancestors():
+            if container is found_in:
+                anchor = preceding
+            container._grid = None
+            container._register(item)
+            if container._focus_ring != None:
+                after = anchor
+                for control in controls:
+                    container._focus_ring.insert_after(after, control)
+                    after = control
+
+    def remove(self, item):
+        """Removes an item from the container at runtime, moving the
+        focus on from any control removed with it."""
+        self.contents = [child for child in self.contents
+                         if child is not item]
+        item.parent = None
+        self.invalidate_layout()
+
+        try:
+            controls = list(item.focusable())
+        except AttributeError:
+            controls = item.can_focus and [item] or []
+
+        for container in self._ancestors():
+            container._grid = None
+            container._unregister(item)
+            ring = container._focus_ring
+            if ring == None:
+                continue
+            focused = container.focused_control
+            if focused in controls:
+                following = ring.next(focused)
+                while following in controls and following is not focused:
+                    following = ring.next(following)
+                focused.focused = False
+                container.focused_control = None
+                if following not in controls:
+                    container.focus(following)
+            for control in controls:
+                ring.remove(control)
+
     def focus(self, control):
-        for child in self.tab_order:
-            child.focused = False
-                
+        if self.focused_control != None:
+            self.focused_control.focused = False
+
         control.focused = True
         
         self.focused_control = control
@@ -125,23 +414,26 @@ class Container(Connectable, object):
         self.owner.dirty = True
 
     def focus_next(self):
-        if self.focused_control == self.tab_order[-1]:
-            self.focus(self.tab_order[0])
-        else:
-            self.focus(self.tab_order[
-                self.tab_order.index(self.focused_control) + 1
-            ])
+        self.focus(self.focus_ring.next(self.focused_control))
         self.owner.dirty = True
 
     def focus_prev(self):
-        if self.focused_control == self.tab_order[0]:
-            self.focus(self.tab_order[-1])
-        else:
-            self.focus(self.tab_order[
-                self.tab_order.index(self.focused_control) - 1
-            ])
+        self.focus(self.focus_ring.prev(self.focused_control))
         self.owner.dirty=True
 
+    def focus_direction(self, dx, dy):
+        """Moves the focus to the nearest control on screen in the
+        direction (dx, dy), such as (0, -1) for up."""
+        if self.focused_control == None or self.focused_control.x == None:
+            return
+        if self._grid == None:
+            self._grid = GridIndex(self.focus_ring)
+
+        control = self._grid.nearest(self.focused_control, dx, dy,
+                                     lambda c: c.owner.shows(c))
+        if control != None:
+            self.focus(control)
+
 class Spacer(Container):
     def __init__(self, height=9, line=False):
         Container.__init__(self, [])
@@ -156,6 +448,8 @@ class Label(Widget):
         self.text = text
         self.alignment = alignment
         self.can_focus = False
+    def cache_key(self):
+        return (self.text, self.alignment)
     def draw(self, drawer):
         self.draw_text(drawer)
 
@@ -168,8 +462,10 @@ class TextArea(Widget):
         self.alignment = alignment
         self.can_focus = False
         self.wrapper = TextWrapper()
+    def cache_key(self):
+        return (self.text, self.alignment)
     def draw(self, drawer):
-        lines, row, col = self.wrapper.wrap(self.text, pixels_to_chars(self.width - line_width * 2))
+        lines, row, col = self.wrapper.wrap(self.text, 0, pixels_to_chars(self.width - line_width * 2))
         y_start = self.y + line_width
         for line in lines:
             if y_start > self.y + self.height - char_height:
@@ -185,6 +481,8 @@ class Button(Widget):
         Widget.__init__(self, name)
         self.text = text
         self.alignment = alignment
+    def cache_key(self):
+        return (self.text, self.alignment, self.focused)
     def draw(self, drawer):
         self.draw_outline(drawer)
         if self.focused:
@@ -192,72 +490,93 @@ class Button(Widget):
         else:
             text = self.text
         self.draw_text(drawer, alignment=self.alignment, text=text)
-    def handle_key(self, char, code):
-        if code in ["KEY_ENTER", "KEY_SPACE"]:
-            self.fire("clicked")
+    bindings = {
+        "KEY_ENTER": "click",
+        "KEY_SPACE": "click"
+    }
+    def click(self, count=1):
+        self.fire("clicked")
         
 
 class Entry(Widget):
     def __init__(self, name=None, text="", placeholder="", password=False, alignment=align.left):
         Widget.__init__(self, name)
-        self._text = text
+        self._buffer = TextBuffer(text)
         self.placeholder = placeholder        
         self.password = password
         self.alignment = alignment
-        self.cursor_pos = len(self._text)
+        self.cursor_pos = len(self._buffer)
     @property
     def text(self):
-        return self._text
+        return self._buffer.text
     @text.setter
     def text(self, new_text):
-        self._text = new_text
-        if len(self.text) < self.cursor_pos:
-            self.cursor_pos = len(self.text)
-        self.fire("text-changed", self._text)
-    def handle_key(self, char, code):
-        if char:
-            self.text = (self.text[:self.cursor_pos] +
-                         char +
-                         self.text[self.cursor_pos:])
-            self.cursor_pos += 1
+        self._buffer = TextBuffer(new_text)
+        if len(self._buffer) < self.cursor_pos:
+            self.cursor_pos = len(self._buffer)
+        self.fire("text-changed", self.text)
+    def cache_key(self):
+        # the buffer and its revision stand for the text, which would
+        # otherwise be joined on every keystroke
+        return (self._buffer, self._buffer.revision, self.placeholder,
+                self.password, self.cursor_pos, self.focused)
+    def _text_changed(self):
+        # only join the text if someone wants it
+        if "text-changed" in self._events:
+            self.fire("text-changed", self.text)
+    bindings = {
+        "KEY_BACKSPACE": "delete_backward",
+        "KEY_ENTER": "submit",
+        "KEY_LEFT": "backward_char",
+        "C-KEY_B": "backward_char",
+        "KEY_RIGHT": "forward_char",
+        "C-KEY_F": "forward_char",
+        "KEY_HOME": "beginning_of_line",
+        "C-KEY_A": "beginning_of_line",
+        "KEY_END": "end_of_line",
+        "C-KEY_E": "end_of_line",
+        "C-KEY_K": "kill_line",
+        "KEY_DELETE": "delete_forward",
+        "C-KEY_D": "delete_forward"
+    }
+    def handle_char(self, char):
+        self._buffer.insert(self.cursor_pos, char)
+        self.cursor_pos += 1
+        self._text_changed()
+        self.redraw()
+        return True
+    def delete_backward(self, count=1):
+        if self.cursor_pos > 0:
+            count = min(count, self.cursor_pos)
+            self.cursor_pos -= count
+            self._buffer.delete(self.cursor_pos, count)
+            self._text_changed()
             self.redraw()
-            return True
-        elif code:
-            if code == "KEY_BACKSPACE":
-                if self.cursor_pos > 0:
-                    old_pos = self.cursor_pos
-                    self.text = (self.text[:self.cursor_pos - 1] +
-                                  self.text[self.cursor_pos:])
-                    self.fire("text-changed", self._text)
-                    self.cursor_pos = old_pos - 1
-                    self.redraw()
-                return True
-            elif code == "KEY_ENTER":
-                self.fire("submitted")
-                self.owner.focus_next()
-            elif code in ["KEY_LEFT", "C-KEY_B"]:
-                if self.cursor_pos > 0:
-                    self.cursor_pos -= 1
-                    self.redraw()
-            elif code in ["KEY_RIGHT", "C-KEY_F"]:
-                if self.cursor_pos < len(self._text):
-                    self.cursor_pos += 1
-                    self.redraw()
-            elif code in ["KEY_HOME", "C-KEY_A"]:
-                self.cursor_pos = 0
-                self.redraw()
-            elif code in ["KEY_END", "C-KEY_E"]:
-                self.cursor_pos = len(self._text)
-                self.redraw()
-            elif code == "C-KEY_K":
-                self.text = self.text[:self.cursor_pos]
-                self.redraw()
-            elif code in ["KEY_DELETE", "C-KEY_D"]:
-                self.text = (self.text[:self.cursor_pos] +
-                              self.text[self.cursor_pos+1:])
-                self.redraw()
-        else:
-            pass
+    def submit(self, count=1):
+        self.fire("submitted")
+        self.owner.focus_next()
+    def backward_char(self, count=1):
+        if self.cursor_pos > 0:
+            self.cursor_pos = max(self.cursor_pos - count, 0)
+            self.redraw()
+    def forward_char(self, count=1):
+        if self.cursor_pos < len(self._buffer):
+            self.cursor_pos = min(self.cursor_pos + count, len(self._buffer))
+            self.redraw()
+    def beginning_of_line(self, count=1):
+        self.cursor_pos = 0
+        self.redraw()
+    def end_of_line(self, count=1):
+        self.cursor_pos = len(self._buffer)
+        self.redraw()
+    def kill_line(self, count=1):
+        self._buffer.delete(self.cursor_pos, len(self._buffer))
+        self._text_changed()
+        self.redraw()
+    def delete_forward(self, count=1):
+        self._buffer.delete(self.cursor_pos, count)
+        self._text_changed()
+        self.redraw()
     def draw(self, drawer):
         self.draw_underline(drawer)
         if self.text != "":
@@ -280,6 +599,9 @@ class Entry(Widget):
                 self.y + self.height - line_width)
             
 class Chooser(Widget):
+    # seconds after which typed letters start a new prefix
+    type_ahead_timeout = 1.0
+
     def __init__(self, name=None, items=list(), placeholder="", selected=0, on_change=None, alignment=align.left):
         Widget.__init__(self, name)
         self.items = items
@@ -287,6 +609,26 @@ class Chooser(Widget):
         self.selected = selected
         self.on_change = on_change
         self.alignment = alignment
+        self._typed = ""
+        self._typed_at = datetime.fromordinal(1)
+
+    @property
+    def items(self):
+        return self._items
+    @items.setter
+    def items(self, items):
+        self._items = items
+        self._index = None
+        self._indexed = None
+
+    def _visible_rows(self):
+        """The range of items whose text falls inside the drop-down."""
+        top = 15 - self.y - line_width
+        bottom = self.owner.height - 15 - char_height - self.y - line_width
+        first = math.floor(top / char_height) + 1 + self.selected
+        last = math.ceil(bottom / char_height) + self.selected
+        return range(max(first, 0), min(last, len(self.items)))
+
     def draw_interaction(self, drawer):
         if self.focused:
             drawer.rectangle(self.x,
@@ -296,16 +638,21 @@ class Chooser(Widget):
                              fill=True)
             self.draw(drawer)
 
-            for i in range(len(self.items)):
+            for i in self._visible_rows():
                 text_y = self.y + chars_to_pixels(i - self.selected, directions.y) + line_width
-                if 15 < text_y < 480 - 15 - char_height:
+                if 15 < text_y < self.owner.height - 15 - char_height:
                     drawer.text(self.x + line_width, text_y, self.items[i])
 
+    def cache_key(self):
+        if self.selected == None:
+            return (self.placeholder, None)
+        return (self.items[self.selected], self.selected)
+
     def draw(self, drawer):
         self.draw_outline(drawer)
         drawer.rectangle(self.x + self.width - char_width - line_width * 2,
                          self.y + 1,
-                         self.width,
+                         self.x + self.width - 2,
                          self.y + self.height - 1)
         drawer.text(self.x + self.width - char_width - line_width,
                     self.y,
@@ -325,48 +672,137 @@ class Chooser(Widget):
                     visible_text(display_text,
                                  display_chars))
 
-    def handle_key(self, char, code):
-        if code:
-            if code in ["KEY_UP", "KEY_LEFT", "C-KEY_P"]:
-                if self.selected > 0:
-                    self.selected -= 1
-                    self.redraw()
-            elif code in ["KEY_DOWN", "KEY_RIGHT", "C-KEY_N"]:
-                if self.selected < len(self.items) - 1:
-                    self.selected += 1
-                    self.redraw()
-            elif code in ["KEY_PAGEDOWN", "C-KEY_V"]:
-                self.selected += pixels_to_chars(480 - 30, directions.y) - 2
-                if self.selected >= len(self.items):
-                    self.selected = len(self.items) - 1
-                self.redraw()
-            elif code in ["KEY_PAGEUP", "A-KEY_V"]:
-                self.selected -= pixels_to_chars(480 - 30, directions.y) + 2
-                if self.selected < 0:
-                    self.selected = 0
-                self.redraw()
-            elif code in ["KEY_HOME", "A-S-KEY_COMMA"]:
-                self.selected = 0
-                self.redraw()
-            elif code in ["KEY_END", "A-S-KEY_DOT"]:
-                self.selected = len(self.items) - 1
-                self.redraw()
-            elif code == "KEY_ENTER":
-                self.owner.focus_next()
+    bindings = {
+        "KEY_UP": "select_previous",
+        "KEY_LEFT": "select_previous",
+        "C-KEY_P": "select_previous",
+        "KEY_DOWN": "select_next",
+        "KEY_RIGHT": "select_next",
+        "C-KEY_N": "select_next",
+        "KEY_PAGEDOWN": "page_down",
+        "C-KEY_V": "page_down",
+        "KEY_PAGEUP": "page_up",
+        "A-KEY_V": "page_up",
+        "KEY_HOME": "select_first",
+        "A-S-KEY_COMMA": "select_first",
+        "KEY_END": "select_last",
+        "A-S-KEY_DOT": "select_last",
+        "KEY_ENTER": "accept"
+    }
+
+    def select_previous(self, count=1):
+        if self.selected > 0:
+            self.selected = max(self.selected - count, 0)
+            self.redraw()
+
+    def select_next(self, count=1):
+        if self.selected < len(self.items) - 1:
+            self.selected = min(self.selected + count, len(self.items) - 1)
+            self.redraw()
+
+    def page_down(self, count=1):
+        self.selected += (pixels_to_chars(self.owner.height - 30, directions.y) - 2) * count
+        if self.selected >= len(self.items):
+            self.selected = len(self.items) - 1
+        self.redraw()
+
+    def page_up(self, count=1):
+        self.selected -= (pixels_to_chars(self.owner.height - 30, directions.y) + 2) * count
+        if self.selected < 0:
+            self.selected = 0
+        self.redraw()
+
+    def select_first(self, count=1):
+        self.selected = 0
+        self.redraw()
+
+    def select_last(self, count=1):
+        self.selected = len(self.items) - 1
+        self.redraw()
+
+    def accept(self, count=1):
+        self.owner.focus_next()
+
+    def _type_ahead_index(self):
+        """The items in lower case, sorted, each with its position."""
+        # comparing with a copy of the items indexed catches any change
+        # to them, and costs much less than sorting them again
+        if self._index == None or self._indexed != self.items:
+            self._indexed = self.items[:]
+            self._index = sorted((item.lower(), i)
+                                 for i, item in enumerate(self.items))
+        return self._index
+
+    def _find_prefix(self, prefix, after=None):
+        """The position of the first item starting with `prefix`, or of
+        the first after the item at `after` in sorted order, or None."""
+        index = self._type_ahead_index()
+        if after == None:
+            found = bisect_left(index, (prefix,))
+        else:
+            found = bisect_left(index, (self.items[after].lower(), after)) + 1
+        if found < len(index) and index[found][0].startswith(prefix):
+            return index[found][1]
+        return None
+
+    def handle_char(self, char):
+        """Selects the first item starting with the letters typed so
+        far.  Typing one letter again steps through the items that
+        start with it."""
+        now = datetime.now()
+        if (now - self._typed_at).total_seconds() > self.type_ahead_timeout:
+            self._typed = ""
+        self._typed_at = now
+        self._typed += char.lower()
+
+        found = self._find_prefix(self._typed)
+        if found == None and self._typed == char.lower() * len(self._typed):
+            self._typed = char.lower()
+            if self.selected != None:
+                found = self._find_prefix(self._typed, self.selected)
+            if found == None:
+                found = self._find_prefix(self._typed)
+
+        if found != None and found != self.selected:
+            self.selected = found
+            self.redraw()
+        return True
 
 class TextEdit(Widget):
     def __init__(self, name=None, text="", rows=None, allow_newlines=True):
         Widget.__init__(self, name)
-        self._text = text
+        self._buffer = TextBuffer(text)
         self.rows = rows
         self.height = line_width + chars_to_pixels(rows, directions.y) + line_width
         self.allow_newlines = allow_newlines
         self.cursor_pos = 0
         self.cursor_loc = [0, 0]
-        self.wrapper = TextWrapper()
+        self.wrapper = TextWrapper(incremental=True)
+        self._wrapped = (None, None, None)
+
+    def cache_key(self):
+        return (self._buffer, self._buffer.revision, self.cursor_pos,
+                self.focused)
 
     def wrap(self):
-        self.lines, self.cursor_loc[0], self.cursor_loc[1] = self.wrapper.wrap(self._text, self.cursor_pos, pixels_to_chars(self.width - line_width * 2))
+        """Wraps the buffer again if it has been edited since the last
+        time, starting from the paragraph of the first edit, and finds
+        the cursor in the rows."""
+        width = pixels_to_chars(self.width - line_width * 2)
+        buffer = self._buffer
+        wrapped = (buffer, buffer.revision, width)
+
+        if wrapped != self._wrapped:
+            if buffer is not self._wrapped[0]:
+                # a new text; the old rows are no use
+                self.wrapper = TextWrapper(incremental=True)
+            self.wrapper.wrap(buffer, self.cursor_pos, width,
+                              buffer.take_changes())
+            self._wrapped = wrapped
+
+        self.lines = self.wrapper.rows
+        self.cursor_loc[0], self.cursor_loc[1] = \
+            self.wrapper.locate(self.cursor_pos)
         
     def draw(self, drawer):
         self.draw_outline(drawer)
@@ -392,107 +828,138 @@ class TextEdit(Widget):
 
     @property
     def text(self):
-        return self._text
+        return self._buffer.text
 
     @text.setter
     def text(self, newtext):
-        self._text = newtext
+        self._buffer = TextBuffer(newtext)
 
-        if len(self._text) < self.cursor_pos:
-            self.cursor_pos = len(self._text)
+        if len(self._buffer) < self.cursor_pos:
+            self.cursor_pos = len(self._buffer)
             
         self.redraw()
 
     def insert_char(self, char):
-        self._text = (self.text[:self.cursor_pos] +
-                     char +
-                     self.text[self.cursor_pos:])
+        self._buffer.insert(self.cursor_pos, char)
         self.cursor_pos += 1
         self.redraw()
 
-    def prev_line(self):
+    def prev_line(self, count=1):
         self.wrap()
         if self.cursor_loc[0] > 0:
-            self.cursor_pos -= len(self.lines[self.cursor_loc[0] -1])
+            for row in range(self.cursor_loc[0] - 1,
+                             max(self.cursor_loc[0] - count, 0) - 1, -1):
+                self.cursor_pos -= len(self.lines[row])
             self.redraw()
         
-    def next_line(self):
+    def next_line(self, count=1):
         self.wrap()
         if self.cursor_loc[0] < len(self.lines) - 1:
-            self.cursor_pos += len(self.lines[self.cursor_loc[0]])
-            if self.cursor_pos > len(self._text):
-                self.cursor_pos = len(self._text)
+            for row in range(self.cursor_loc[0],
+                             min(self.cursor_loc[0] + count,
+                                 len(self.lines) - 1)):
+                self.cursor_pos += len(self.lines[row])
+            if self.cursor_pos > len(self._buffer):
+                self.cursor_pos = len(self._buffer)
             self.redraw()
-            
-    def handle_key(self, char, code):
-        if char:
-            self.insert_char(char)
-            return True
-        elif code:
-            if code == "KEY_BACKSPACE":
-                if self.cursor_pos > 0:
-                    self._text = (self.text[:self.cursor_pos - 1] +
-                                  self.text[self.cursor_pos:])
-                    self.cursor_pos -= 1
-                    self.redraw()
-                    self.fire("text-changed", self._text)
-                return True
-            elif code == "KEY_ENTER":
-                if self.allow_newlines:
-                    self.insert_char("\n")
-                else:
-                    self.fire("submitted")
-                    self.owner.focus_next()
-            elif code in ["KEY_UP", "C-KEY_P"]:
-                self.prev_line()
-            elif code in ["KEY_DOWN", "C-KEY_N"]:
-                self.next_line()
-            elif code in ["KEY_LEFT", "C-KEY_B"]:
-                if self.cursor_pos > 0:
-                    self.cursor_pos -= 1
-                    self.redraw()
-            elif code in ["C-KEY_LEFT", "A-KEY_B"]:
-                if self.cursor_pos > 0:
-                    for i in range(self.cursor_pos - 2, 0, -1):
-                        if self.text[i] not in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789":
-                            self.cursor_pos = i + 1
-                            self.redraw()
-                            break
-            elif code in ["KEY_RIGHT", "C-KEY_F"]:
-                if self.cursor_pos < len(self._text):
-                    self.cursor_pos += 1
-                    self.redraw()
-            elif code in ["C-KEY_RIGHT", "A-KEY_F"]:
-                if self.cursor_pos < len(self.text) - 1:
-                    for i in range(self.cursor_pos + 2, len(self.text)):
-                        if self.text[i] not in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789":
-                            self.cursor_pos = i
-                            self.redraw()
-                            break
-            elif code in ["KEY_HOME", "C-KEY_A"]:
-                self.wrap()
-                self.cursor_pos -= self.cursor_loc[1]
-                self.redraw()
-            elif code in ["KEY_END", "C-KEY_E"]:
-                self.wrap()
-                self.cursor_pos -= self.cursor_loc[1]
-                self.cursor_pos += len(self.lines[self.cursor_loc[0]]) - 1
-                self.redraw()
-            elif code in ["C-KEY_HOME", "A-S-KEY_COMMA"]:
-                self.cursor_pos = 0
-                self.redraw()
-            elif code in ["C-KEY_END", "A-S-KEY_DOT"]:
-                self.cursor_pos = len(self._text)
-                self.redraw()
-            elif code == "C-KEY_K":
-                self._text = self.text[:self.cursor_pos]
-                self.cursor_pos = len(self.text)
-                self.redraw()
-            elif code in ["KEY_DELETE", "C-KEY_D"]:
-                self.text = (self.text[:self.cursor_pos] +
-                              self.text[self.cursor_pos+1:])
+
+    bindings = {
+        "KEY_BACKSPACE": "delete_backward",
+        "KEY_ENTER": "newline",
+        "KEY_UP": "prev_line",
+        "C-KEY_P": "prev_line",
+        "KEY_DOWN": "next_line",
+        "C-KEY_N": "next_line",
+        "KEY_LEFT": "backward_char",
+        "C-KEY_B": "backward_char",
+        "C-KEY_LEFT": "backward_word",
+        "A-KEY_B": "backward_word",
+        "KEY_RIGHT": "forward_char",
+        "C-KEY_F": "forward_char",
+        "C-KEY_RIGHT": "forward_word",
+        "A-KEY_F": "forward_word",
+        "KEY_HOME": "beginning_of_line",
+        "C-KEY_A": "beginning_of_line",
+        "KEY_END": "end_of_line",
+        "C-KEY_E": "end_of_line",
+        "C-KEY_HOME": "beginning_of_text",
+        "A-S-KEY_COMMA": "beginning_of_text",
+        "C-KEY_END": "end_of_text",
+        "A-S-KEY_DOT": "end_of_text",
+        "C-KEY_K": "kill_line",
+        "KEY_DELETE": "delete_forward",
+        "C-KEY_D": "delete_forward"
+    }
+
+    def handle_char(self, char):
+        self.insert_char(char)
+        return True
+
+    def delete_backward(self, count=1):
+        if self.cursor_pos > 0:
+            count = min(count, self.cursor_pos)
+            self.cursor_pos -= count
+            self._buffer.delete(self.cursor_pos, count)
+            self.redraw()
+            if "text-changed" in self._events:
+                self.fire("text-changed", self.text)
+
+    def newline(self, count=1):
+        if self.allow_newlines:
+            self.insert_char("\n")
         else:
-            pass
+            self.fire("submitted")
+            self.owner.focus_next()
+
+    def backward_char(self, count=1):
+        if self.cursor_pos > 0:
+            self.cursor_pos = max(self.cursor_pos - count, 0)
+            self.redraw()
+
+    def backward_word(self, count=1):
+        if self.cursor_pos > 0:
+            for i in range(count):
+                self.cursor_pos = self._buffer.word_start(self.cursor_pos)
+            self.redraw()
+
+    def forward_char(self, count=1):
+        if self.cursor_pos < len(self._buffer):
+            self.cursor_pos = min(self.cursor_pos + count, len(self._buffer))
+            self.redraw()
+
+    def forward_word(self, count=1):
+        if self.cursor_pos < len(self._buffer):
+            for i in range(count):
+                self.cursor_pos = self._buffer.word_end(self.cursor_pos)
+            self.redraw()
+
+    def beginning_of_line(self, count=1):
+        self.wrap()
+        self.cursor_pos -= self.cursor_loc[1]
+        self.redraw()
+
+    def end_of_line(self, count=1):
+        self.wrap()
+        self.cursor_pos -= self.cursor_loc[1]
+        self.cursor_pos += len(self.lines[self.cursor_loc[0]]) - 1
+        self.redraw()
+
+    def beginning_of_text(self, count=1):
+        self.cursor_pos = 0
+        self.redraw()
+
+    def end_of_text(self, count=1):
+        self.cursor_pos = len(self._buffer)
+        self.redraw()
+
+    def kill_line(self, count=1):
+        self._buffer.delete(self.cursor_pos, len(self._buffer))
+        self.redraw()
+
+    def delete_forward(self, count=1):
+        self._buffer.delete(self.cursor_pos, count)
+        self.redraw()
+
 class DateTimePicker(Widget):
     def __init__(self, name=None, init_val=datetime.now(), show_date=True, show_time=False):
         Widget.__init__(self, name)
@@ -506,43 +973,30 @@ class Row(Container):
     def __init__(self, contents=list()):
         Container.__init__(self, contents)
 
-    def do_layout(self, x, y, width, height, owner=None):
-        self.owner = owner
+    def _measure(self, width):
+        item_width = math.floor(width / len(self.contents))
+        return max([child.measure(item_width) for child in self.contents])
+
+    def _arrange(self, x, y, width, height, owner):
         item_width = math.floor(width / len(self.contents))
         
         for child_index in range(len(self.contents)):
             child = self.contents[child_index]
-            
-            try:
-                child.do_layout(x + item_width * child_index, y, item_width, height, owner=owner)
-            except AttributeError:
-                child.x = x + item_width * child_index
-                child.y = y
-                child.width = item_width
-                child.owner = owner
-
-        self.height = max([child.height for child in self.contents])
-        self.width = width
+            child.arrange(x + item_width * child_index, y, item_width,
+                          height, owner)
 
 class Column(Container):
     def __init__(self, contents=list()):
         Container.__init__(self, contents)
 
-    def do_layout(self, x, y, width, height, owner=None):
-        self.owner = owner
-        self.width = width
-        self.height = 0
+    def _measure(self, width):
+        return sum([child.measure(width) for child in self.contents])
+
+    def _arrange(self, x, y, width, height, owner):
+        next_y = y
         for child in self.contents:
-            
-            try:
-                child.do_layout(x, y + self.height, width, height, owner=owner)
-            except AttributeError:
-                child.x = x
-                child.y = y + self.height
-                child.width = width
-                child.owner = owner
-                
-            self.height += child.height
+            child.arrange(x, next_y, width, height, owner)
+            next_y += child.measure(width)
 
 class Popup(Column):
     def __init__(self, width, title="Popup", contents=list(), owner=None):
@@ -572,19 +1026,25 @@ class Popup(Column):
         if self._dirty:
             self.owner.dirty = True
 
-    def do_layout(self, x, y, width, height, owner=None):
+    def arrange(self, x, y, width, height, owner=None):
+        """Centres the popup on its owner, keeping its own width."""
         self.owner = owner
+        self._grid = None
 
+        # measuring first gives the height to centre on, so the
+        # contents only need placing once
+        self.height = self.measure(self.width)
         self.x = math.floor(owner.width / 2 - self.width / 2)
-
-        # do layout once to figure height of all contents
-        Column.do_layout(self, self.x, y, self.width, self.height, owner=self.owner)
-
-        # figure y based on finalized height
         self.y = math.floor(owner.height / 2 - self.height / 2)
 
-        # redo layout with corrected position
-        Column.do_layout(self, self.x, self.y, self.width, self.height, owner=self.owner)
+        Column._arrange(self, self.x, self.y, self.width, self.height,
+                        owner)
+        self._arranged = (x, y, width, height, owner)
+
+    def invalidate_layout(self):
+        Column.invalidate_layout(self)
+        if self.owner != None:
+            self.owner.invalidate_layout()
 
     def draw_contents(self, drawer):
         drawer.rectangle(self.x + 1, self.y + 1,
@@ -600,10 +1060,32 @@ class Popup(Column):
         
         
 class Form(Container):
+    bindings = {
+        "KEY_F12": "quit",
+        "KEY_PAUSE": "abort",
+        "KEY_TAB": "next_control",
+        "S-KEY_TAB": "prev_control",
+        "KEY_ESC": "close_popup",
+        "A-KEY_UP": "focus_up",
+        "A-KEY_DOWN": "focus_down",
+        "A-KEY_LEFT": "focus_left",
+        "A-KEY_RIGHT": "focus_right"
+    }
+
     def __init__(self, *contents, **kwargs):
         Container.__init__(self, contents)
         self.key_translator = KeyTranslator()
 
+        # guards dirty/finished; the draw thread sleeps on it until
+        # there is something to draw
+        self._redraw_condition = Condition()
+        self._draw_thread = None
+        self.pipeline = None
+
+        # set by run_async; the draw task waits on the event instead
+        self._loop = None
+        self._redraw_event = None
+
         try:
             self.debug = kwargs["debug"]
         except KeyError:
@@ -619,6 +1101,12 @@ class Form(Container):
         except KeyError:
             self.height = 480
 
+        try:
+            self.coalescing = kwargs["coalescing"]
+        except KeyError:
+            self.coalescing = AdaptiveCoalescing()
+
+        self._popup = None
         self.do_layout()
 
         self.finished = False
@@ -632,18 +1120,21 @@ class Form(Container):
         self._dirty_time = datetime.fromordinal(1)
         self._last_draw = datetime.fromordinal(1)
 
-        self._popup = None
         self._show_popup = False
 
         self.keybindings = {}
 
+        self._keymap = None
+        self._keymap_key = None
+        self._chord = None
+
     @property
     def popup(self):
         return self._popup
 
     @popup.setter
     def popup(self, new_popup):
-        new_popup.do_layout(0, 0, self.width, self.height, self)
+        new_popup.arrange(0, 0, self.width, self.height, self)
         self._popup = new_popup
 
     @property
@@ -666,117 +1157,387 @@ class Form(Container):
 
     @dirty.setter
     def dirty(self, value=True):
-        self._dirty = value
-        self._dirty_time = datetime.now()
+        with self._redraw_condition:
+            self._dirty = value
+            self._dirty_time = datetime.now()
+            self._redraw_condition.notify_all()
+        self._wake_draw_task()
 
     def finish(self):
-        self.finished = True
+        with self._redraw_condition:
+            self.finished = True
+            self._redraw_condition.notify_all()
+        self._wake_draw_task()
         self.keyboard.stop()
+
+    def _wake_draw_task(self):
+        """Wakes the draw task of `run_async`; safe to call from any
+        thread, such as a paginator's."""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._redraw_event.set)
         
+    def invalidate_layout(self):
+        self._layout_valid = False
+        self.dirty = True
+
+    def _forget_layout(self, container):
+        container._measured = None
+        container._arranged = None
+        for item in container.contents:
+            try:
+                self._forget_layout(item)
+            except AttributeError:
+                pass
+
+    def update_layout(self):
+        """Lays out again whatever changed size since the last layout,
+        leaving everything else where it is."""
+        if self._layout_valid:
+            return
+        self._layout_valid = True
+        self._grid = None
+
+        next_y = 0
+        for child in self.contents:
+            child.arrange(0, next_y, self.width, self.height, self)
+            next_y += child.measure(self.width)
+
+        if self._popup != None and self._popup._arranged == None:
+            self._popup.arrange(0, 0, self.width, self.height, self)
+
     def do_layout(self):
+        """Lays out the whole form afresh."""
         self.owner = self
-        next_y = 0
+        self._forget_layout(self)
+        self._layout_valid = False
+        self.update_layout()
+
+        # names of the widgets in the form, for control(); the popup's
+        # widgets are not among them
+        self._names = {}
+        self._unordered = set()
+        for widget in self.widgets():
+            self._names.setdefault(widget.name, []).append(widget)
+
+    def _named(self, name):
+        """Returns the widgets called `name`, in tree order."""
+        if name in self._unordered:
+            self._unordered.discard(name)
+            if name in self._names:
+                self._names[name] = [widget for widget in self.widgets()
+                                     if widget.name == name]
+        return self._names.get(name, ())
+
+    def _add_name(self, widget):
+        named = self._names.setdefault(widget.name, [])
+        named.append(widget)
+        if len(named) > 1:
+            # put back in tree order when next looked up
+            self._unordered.add(widget.name)
 
-        for child in self.contents:
-            try:
-                child.do_layout(0, next_y, self.width, self.height, owner=self)
-            except AttributeError:
-                child.x = 0
-                child.y = next_y
-                child.width = self.width
-                child.owner = self
-                
-            next_y += child.height
+    def control(self, name):
+        named = self._named(name)
+        if named:
+            return named[0]
+        return None
 
-    def _time_to_redraw(self):
+    def controls(self, name):
+        return list(self._named(name))
+
+    def _rename(self, widget, old_name, new_name):
+        try:
+            self._names[old_name].remove(widget)
+        except (KeyError, ValueError):
+            # not one of the form's own widgets
+            return
+        if not self._names[old_name]:
+            del self._names[old_name]
+        self._add_name(widget)
+
+    def _register(self, item):
+        try:
+            widgets = list(item.widgets())
+        except AttributeError:
+            widgets = [item]
+        for widget in widgets:
+            self._add_name(widget)
+
+    def _unregister(self, item):
+        try:
+            widgets = list(item.widgets())
+        except AttributeError:
+            widgets = [item]
+        for widget in widgets:
+            try:
+                self._names[widget.name].remove(widget)
+            except (KeyError, ValueError):
+                continue
+            if not self._names[widget.name]:
+                del self._names[widget.name]
+
+    def _seconds_to_redraw(self):
+        """Returns how long to wait before the pending redraw is due,
+        as decided by the form's coalescing policy."""
         if self.debug:
-            return True
+            return 0
         else:
-            return ((datetime.now() - self._dirty_time).total_seconds() > 0.75 or
-                    (datetime.now() - self._last_draw).total_seconds() > 5.75)
-    def _draw(self, drawer):
-        while not self.finished:
-            if self.dirty and self._time_to_redraw():
+            now = datetime.now()
+            return min(self.coalescing.delay -
+                       (now - self._dirty_time).total_seconds(),
+                       self.coalescing.max_wait -
+                       (now - self._last_draw).total_seconds())
+
+    def _time_to_redraw(self):
+        return self._seconds_to_redraw() <= 0
+
+    def _wait_for_redraw(self):
+        """Blocks until a redraw is due, returning False if the form
+        finished instead."""
+        with self._redraw_condition:
+            while not self.finished:
+                if not self._dirty:
+                    self._redraw_condition.wait()
+                    continue
+
+                delay = self._seconds_to_redraw()
+                if delay > 0:
+                    self._redraw_condition.wait(delay)
+                    continue
+
                 self.dirty = False
                 self._last_draw = datetime.now()
-                drawer.new_screen()
-                self.draw_contents(drawer)
+                return True
+        return False
+
+    def _render(self, drawer):
+        self.update_layout()
+        drawer.new_screen()
+        self.draw_contents(drawer)
+        try:
+            self.focused_control.draw_interaction(drawer)
+        except AttributeError:
+            pass
+
+        if self.show_popup:
+            self.popup.draw_contents(drawer)
+
+    def _draw(self, drawer):
+        while self._wait_for_redraw():
+            self._render(drawer)
+
+            # new_screen gives the next frame a fresh image, so this
+            # one can be sent while that is drawn
+            self.pipeline.submit(drawer.screen)
+
+        self.pipeline.stop()
+
+    async def _wait_for_redraw_async(self):
+        """Like `_wait_for_redraw`, but sleeps on the event loop."""
+        while not self.finished:
+            self._redraw_event.clear()
+            if not self._dirty:
+                await self._redraw_event.wait()
+                continue
+
+            delay = self._seconds_to_redraw()
+            if delay > 0:
                 try:
-                    self.focused_control.draw_interaction(drawer)
-                except AttributeError:
+                    await asyncio.wait_for(self._redraw_event.wait(), delay)
+                except asyncio.TimeoutError:
                     pass
+                continue
 
-                if self.show_popup:
-                    self.popup.draw_contents(drawer)
-                
-                drawer.send()
-        exit()
+            self.dirty = False
+            self._last_draw = datetime.now()
+            return True
+        return False
+
+    async def _draw_async(self, drawer):
+        while await self._wait_for_redraw_async():
+            self._render(drawer)
+
+            # sending blocks on the display, so it goes to an executor
+            # and key events keep being handled meanwhile
+            started = datetime.now()
+            changed = await self._loop.run_in_executor(None, drawer.send,
+                                                       drawer.screen)
+            if changed != False:
+                self.coalescing.record_send(
+                    (datetime.now() - started).total_seconds())
 
     def draw(self, drawer):
-        display_thread = Thread(target=self._draw,
-                                args=(drawer,))
-        display_thread.daemon = True
-        display_thread.start()
+        self.pipeline = DisplayPipeline(drawer, self.coalescing.record_send)
 
-    def handle_key(self, keycode, keystate):
-        char, code = self.key_translator.translate(keycode, keystate)
+        self._draw_thread = Thread(target=self._draw,
+                                   args=(drawer,))
+        self._draw_thread.daemon = True
+        self._draw_thread.start()
 
-        if self.show_popup:
-            focused_form = self.popup
-        else:
-            focused_form = self
-
-        if code == "KEY_F12":
-            self.finish()
-        elif code == "KEY_PAUSE":
-            exit()
-        elif char == "\t":
-            focused_form.focus_next()
-        elif code == "S-KEY_TAB":
-            focused_form.focus_prev()
-        elif code == "KEY_ESC":
-            self.show_popup = False
-        elif self._handled_by_keybinding(char, code):
-            pass
-        elif self._handled_by_container(char, code):
-            pass
-        elif char or code:
-            focused_form.focused_control.handle_key(char, code)
+    def wait_for_draw(self, timeout=None):
+        """Waits for the draw thread, and the frames it rendered, to be
+        done after `finish`, so that a frame is never left half-sent."""
+        if self._draw_thread:
+            self._draw_thread.join(timeout)
+
+    def quit(self, count=1):
+        self.finish()
+
+    def abort(self, count=1):
+        exit()
+
+    def next_control(self, count=1):
+        for i in range(count):
+            self._focused_form().focus_next()
 
-    def _handled_by_container(self, char, code):
+    def prev_control(self, count=1):
+        for i in range(count):
+            self._focused_form().focus_prev()
+
+    def close_popup(self, count=1):
+        self.show_popup = False
+
+    def focus_up(self, count=1):
+        self.update_layout()
+        for i in range(count):
+            self._focused_form().focus_direction(0, -1)
+
+    def focus_down(self, count=1):
+        self.update_layout()
+        for i in range(count):
+            self._focused_form().focus_direction(0, 1)
+
+    def focus_left(self, count=1):
+        self.update_layout()
+        for i in range(count):
+            self._focused_form().focus_direction(-1, 0)
+
+    def focus_right(self, count=1):
+        self.update_layout()
+        for i in range(count):
+            self._focused_form().focus_direction(1, 0)
+
+    def _focused_form(self):
         if self.show_popup:
-            focused_form = self.popup
+            return self.popup
         else:
-            focused_form = self
-            
+            return self
+
+    def _keymap_layers(self):
+        """Returns the (target, bindings) that apply to the focused
+        control, the lowest precedence first: the control, its
+        container, the popup, the form's bind_key events, then the
+        form's own bindings, so that quitting, moving the focus and
+        closing the popup cannot be bound over."""
+        focused_form = self._focused_form()
+        layers = []
+
         try:
-            return focused_form.focused_control.owner.handle_key(char, code)
+            control = focused_form.focused_control
         except AttributeError:
-            return False
-        
-    def _handled_by_keybinding(self, char, code):
+            control = None
+
+        if control != None:
+            layers.append((control, control.bindings))
+            if control.owner not in [None, self, focused_form]:
+                layers.append((control.owner, control.owner.bindings))
+
+        if self.show_popup:
+            layers.append((self.popup, self.popup.bindings))
+
+        layers.append((self, dict((code, self._key_events_action(code))
+                                  for code in self.keybindings)))
+        layers.append((self, self.bindings))
+        return layers
+
+    def compiled_keymap(self):
+        """Returns the table keys are looked up in, compiling it again
+        when the focus, the container of the focused control or any
+        bindings have changed."""
         try:
-            events = self.keybindings[code]
-        except KeyError:
-            return False
+            control = self._focused_form().focused_control
+            owner = control.owner
+        except AttributeError:
+            control = owner = None
+
+        key = (control, owner, self.show_popup, keymap.generation)
+        if key != self._keymap_key:
+            self._keymap = keymap.compile_keymap(self._keymap_layers())
+            self._keymap_key = key
+        return self._keymap
+
+    def handle_key(self, keycode, keystate, repeat=1):
+        """Handles a key event from the keyboard; `repeat` is how many
+        times a held key repeated, when the reader collapsed several
+        repeats into one event."""
+        char, code = self.key_translator.translate(keycode, keystate)
+        if not (char or code):
+            return
 
-        for event in events:
-            try:
-                event(self, self.focused_control, code)
-            except Exception as e:
-                print("Error in key handler for code %s:\n\n%s" % (code, e))
-                      
-        return True
+        table = self._chord or self.compiled_keymap()
+        action = table.get(code)
+
+        if isinstance(action, dict):
+            # the start of a chord; wait for the rest of it
+            self._chord = action
+            return
+
+        in_chord = self._chord != None
+        self._chord = None
+
+        if action != None:
+            spawn(action(repeat))
+        elif in_chord:
+            pass
+        elif repeat > 1:
+            self._focused_form().focused_control.handle_key_repeat(
+                char, code, repeat)
+        else:
+            self._focused_form().focused_control.handle_key(char, code)
+
+    def _key_events_action(self, code):
+        def action(form, count):
+            for i in range(count):
+                for event in self.keybindings[code]:
+                    try:
+                        spawn(event(self, self.focused_control, code))
+                    except Exception as e:
+                        print("Error in key handler for code %s:\n\n%s" %
+                              (code, e))
+        return action
                       
     def bind_key(self, code, event):
         try:
             self.keybindings[code].append(event)
         except:
             self.keybindings[code] = [event]
-        
+        keymap.changed()
 
     def run(self, keyboard, screen):
         self.keyboard = keyboard
         self.drawer = screen
         self.draw(screen)
-        keyboard.event_loop(self.handle_key)
+        try:
+            keyboard.event_loop(self.handle_key)
+        finally:
+            # the keyboard may have gone away without a KEY_F12
+            if not self.finished:
+                self.finish()
+        self.wait_for_draw()
+
+    async def run_async(self, keyboard, screen):
+        """Runs the form on the running asyncio loop: key events are
+        read with the keyboard's `async_event_loop` and frames drawn by
+        a task, so event handlers may be coroutines that await."""
+        self.keyboard = keyboard
+        self.drawer = screen
+        self._loop = asyncio.get_running_loop()
+        self._redraw_event = asyncio.Event()
+
+        draw_task = self._loop.create_task(self._draw_async(screen))
+        try:
+            await keyboard.async_event_loop(self.handle_key)
+        finally:
+            if not self.finished:
+                self.finish()
+            await draw_task
+            self._loop = None
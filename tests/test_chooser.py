@@ -0,0 +1,36 @@
+from paperui.ui import Form, Chooser
+
+def chooser(items):
+    chooser = Chooser(items=items)
+    Form(chooser)
+    return chooser
+
+def typed(chooser, letters):
+    for letter in letters:
+        chooser.handle_char(letter)
+    return chooser.items[chooser.selected]
+
+def test_typing_selects_by_prefix_and_steps_through_a_letter():
+    names = chooser(["Cherry", "banana", "Apple", "blueberry", "avocado"])
+    assert typed(names, "bl") == "blueberry"
+
+    names._typed = ""
+    assert typed(names, "a") == "Apple"
+    assert typed(names, "a") == "avocado"
+    assert typed(names, "a") == "Apple"
+
+def test_typing_starts_over_after_a_pause():
+    names = chooser(["banana", "blueberry", "cherry"])
+    names.type_ahead_timeout = 0
+    assert typed(names, "b") == "banana"
+    assert typed(names, "c") == "cherry"
+    assert typed(names, "b") == "banana"
+
+def test_items_changed_in_place_are_found():
+    items = ["apple", "banana", "cherry"]
+    names = chooser(items)
+    assert typed(names, "c") == "cherry"
+
+    items[1] = "date"
+    names.type_ahead_timeout = 0
+    assert typed(names, "d") == "date"
@@ -0,0 +1,61 @@
+from PIL import Image, ImageDraw
+
+from paperui.core import ScreenDrawer
+
+class Display(object):
+    """Records what a ScreenDrawer sends, in place of the panel."""
+    def __init__(self):
+        self.calls = []
+    def reset_data_pointer(self):
+        self.calls.append(("reset",))
+    def send_image(self, data):
+        self.calls.append(("image", len(data)))
+    def update_display(self):
+        self.calls.append(("full",))
+    def send_region(self, box, data):
+        self.calls.append(("region", box, len(data)))
+    def update_partial(self):
+        self.calls.append(("partial",))
+
+def frame(*rectangles):
+    image = Image.new("1", (800, 480), 1)
+    drawer = ImageDraw.Draw(image)
+    for rectangle in rectangles:
+        drawer.rectangle(rectangle, fill=0)
+    return image
+
+def sent(drawer, image):
+    drawer.display.calls = []
+    drawer.send(image)
+    return drawer.display.calls
+
+def test_small_changes_are_sent_as_byte_aligned_regions():
+    drawer = ScreenDrawer(display=Display())
+    assert sent(drawer, frame())[-1] == ("full",)
+
+    calls = sent(drawer, frame((13, 21, 40, 30), (301, 200, 305, 260)))
+    regions = [call for call in calls if call[0] == "region"]
+    assert regions and calls[-1] == ("partial",)
+    for name, box, length in regions:
+        left, top, right, bottom = box
+        assert left % 8 == 0 and right % 8 == 0
+        assert length == (right - left) // 8 * (bottom - top)
+
+def test_nothing_is_sent_for_an_unchanged_frame():
+    drawer = ScreenDrawer(display=Display())
+    drawer.send(frame((10, 10, 20, 20)))
+    assert sent(drawer, frame((10, 10, 20, 20))) == []
+
+def test_full_refresh_when_partial_updates_are_not_allowed():
+    drawer = ScreenDrawer(display=Display())
+    drawer.send(frame())
+
+    # too much of the panel changed
+    calls = sent(drawer, frame((0, 0, 700, 400)))
+    assert calls == [("reset",), ("image", 800 * 480 // 8), ("full",)]
+
+    # too many partial updates since the last full refresh
+    drawer._partial_updates = drawer.full_refresh_interval
+    calls = sent(drawer, frame((10, 10, 20, 20)))
+    assert calls[-1] == ("full",)
+    assert not [call for call in calls if call[0] == "region"]
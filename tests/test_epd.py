@@ -0,0 +1,42 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+pil2epd = pytest.importorskip("pil2epd")
+pytest.importorskip("numpy")
+
+from paperui.epd import encode, panel_box
+
+SIZES = [(800, 480), (480, 800), (264, 176), (200, 200), (96, 64)]
+
+def scribble(rng, size):
+    image = Image.new("1", size, 1)
+    drawer = ImageDraw.Draw(image)
+    for i in range(20):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        drawer.rectangle([x, y,
+                          x + rng.randrange(40), y + rng.randrange(40)],
+                         fill=rng.randrange(2))
+    return image
+
+@pytest.mark.parametrize("size", SIZES)
+def test_encode_matches_rotating_and_converting(size):
+    rng = random.Random(size[0] * 1000 + size[1])
+    for trial in range(10):
+        image = scribble(rng, size)
+        rotated = image.rotate(270)
+        assert encode(image) == pil2epd.convert(rotated)
+
+@pytest.mark.parametrize("size", SIZES)
+def test_encode_of_a_box_matches_cropping(size):
+    rng = random.Random(size[0] * 1000 + size[1])
+    checked = 0
+    while checked < 10:
+        image = scribble(rng, size)
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        box = panel_box((x, y, x + 30, y + 30), size)
+        if box:
+            rotated = image.rotate(270)
+            assert encode(image, box) == pil2epd.convert(rotated.crop(box))
+            checked += 1
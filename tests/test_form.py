@@ -0,0 +1,43 @@
+from paperui.ui import Form, Column, Button
+
+def test_adding_and_removing_on_a_form():
+    a, b, c = Button(name="a"), Button(name="b"), Button(name="c")
+    form = Form(a, b)
+    assert form.focused_control is a
+
+    form.add(c, 1)
+    assert form.contents == [a, c, b]
+    assert form.tab_order == [a, c, b]
+    assert form.control("c") is c
+
+    form.remove(a)
+    assert form.tab_order == [c, b]
+    assert form.focused_control is c and c.focused and not a.focused
+    assert form.control("a") is None
+
+def test_registry_follows_renames_adds_and_removes_in_tree_order():
+    first, second = Button(name="dup"), Button(name="dup")
+    column = Column()
+    form = Form(column, first)
+    form.add(second)
+    assert form.controls("dup") == [first, second]
+
+    # added ahead of both, inside the column
+    earlier = Button(name="dup")
+    column.add(earlier)
+    assert form.control("dup") is earlier
+    assert form.controls("dup") == [earlier, first, second]
+    assert form.control("dup") is Column.control(form, "dup")
+
+    earlier.name = "other"
+    assert form.control("dup") is first
+    assert form.control("other") is earlier
+    first.name = "dup2"
+    second.name = "dup2"
+    assert form.controls("dup2") == [first, second]
+    assert form.controls("dup") == []
+
+    column.remove(earlier)
+    assert form.control("other") is None
+    second.name = "other"
+    assert form.control("other") is second
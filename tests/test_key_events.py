@@ -0,0 +1,26 @@
+import asyncio
+
+from paperui.core import ScreenDrawer
+from paperui.key_events import KeyReader, FakeInputDevice
+from paperui.ui import Form, Button
+
+from test_core import Display
+
+def test_quit_ends_run_async_without_another_key():
+    device = FakeInputDevice()
+    button = Button(name="quit", text="Quit")
+    form = Form(button)
+
+    async def quit(form, button, data):
+        await asyncio.sleep(0.05)
+        form.quit()
+    button.connect("clicked", quit)
+
+    async def run():
+        device.press("KEY_ENTER")
+        await asyncio.wait_for(
+            form.run_async(KeyReader(device), ScreenDrawer(display=Display())),
+            5)
+
+    asyncio.run(run())
+    assert form.finished
@@ -0,0 +1,11 @@
+from paperui import keyboard
+
+def test_key_name_prefers_a_key_to_its_aliases(monkeypatch):
+    monkeypatch.setitem(keyboard.ecodes.KEY, 113,
+                        ["KEY_MIN_INTERESTING", "KEY_MUTE"])
+    monkeypatch.setitem(keyboard.ecodes.KEY, 0x98,
+                        ["KEY_COFFEE", "KEY_SCREENLOCK"])
+    monkeypatch.setitem(keyboard.ecodes.KEY, 0x2ff, ["KEY_MAX"])
+    assert keyboard.key_name(113) == "KEY_MUTE"
+    assert keyboard.key_name(0x98) == "KEY_COFFEE"
+    assert keyboard.key_name(0x2ff) == "KEY_MAX"
@@ -0,0 +1,70 @@
+from evdev import ecodes
+
+from paperui.ui import Form, Button
+from paperui.special.pageflow import VirtualPageFlow
+
+def button(index, recycled):
+    return Button(text="Item %d" % index)
+
+def test_turning_pages_without_drawing():
+    flow = VirtualPageFlow(button, count=200)
+    form = Form(flow)
+
+    # the widgets made for a new page are only arranged when the form
+    # is drawn, so paging must not wait for that
+    form.handle_key(ecodes.KEY_RIGHT, 1)
+    form.handle_key(ecodes.KEY_RIGHT, 1)
+    form.handle_key(ecodes.KEY_RIGHT, 1)
+
+    assert flow.current_page == 3
+    assert form.focused_control.owner is flow
+    assert flow.shows(form.focused_control)
+
+def test_items_of_different_heights_from_an_iterator():
+    heights = [90 if i % 3 == 0 else 30 for i in range(50)]
+    shown = []
+    flow = VirtualPageFlow(lambda item, recycled: Button(name=str(item)),
+                           items=iter(range(50)),
+                           height_of=lambda item: heights[item],
+                           max_height=200)
+    form = Form(flow)
+    assert flow.page_count() == None
+
+    while True:
+        page = [int(widget.name) for widget in flow.contents
+                if flow.shows(widget)]
+        assert sum(heights[item] for item in page) <= 200
+        shown.extend(page)
+        before = flow.current_page
+        flow.next_page()
+        if flow.current_page == before:
+            break
+
+    assert shown == list(range(50))
+    assert flow.page_count() == flow.current_page + 1
+
+def test_recycled_widgets_are_found_under_their_new_items():
+    made = []
+    def factory(index, recycled):
+        if recycled == None:
+            recycled = Button()
+            made.append(recycled)
+        recycled.name = "item %d" % index
+        recycled.text = "Item %d" % index
+        return recycled
+
+    flow = VirtualPageFlow(factory, count=200)
+    form = Form(flow)
+    per_page = flow._per_page
+    for page in range(10):
+        flow.next_page()
+
+    assert len(made) <= 4 * per_page
+    assert len(flow.contents) <= 3 * per_page
+
+    focused = form.focused_control
+    assert focused.focused and flow.shows(focused)
+    assert focused.name == "item %d" % (10 * per_page)
+    assert form.control(focused.name) is focused
+    assert form.control("item 0") is None
+    assert form.tab_order == flow.contents
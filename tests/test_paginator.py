@@ -0,0 +1,45 @@
+from paperui.special.paginator import Paginator, MappedText, _escaped_bytes
+
+class Font(object):
+    """Fixed-width metrics where a blank row is shorter than one with
+    text, as with real fonts."""
+    def getsize(self, text):
+        if text.strip():
+            return (len(text) * 8, 18)
+        return (len(text) * 8, 15)
+
+def text():
+    words = "alpha beta gamma delta epsilon zeta eta theta".split()
+    return "\n".join(" ".join(words[(i + j) % len(words)]
+                              for j in range(i * 7 % 40))
+                     for i in range(200))
+
+def rows(page):
+    return [(line.text, line.start, line.end) for line in page]
+
+def test_page_between_matches_first_pagination():
+    for ending in ["", "\n"]:
+        for height in range(60, 200, 7):
+            paginator = Paginator(Font(), [400, height])
+            for page in paginator.iter_pages(text() + ending):
+                again = paginator.page_between(text() + ending,
+                                               page.start, page.end)
+                assert rows(again) == rows(page)
+                assert (again.start, again.end) == (page.start, page.end)
+
+def test_mapped_text_rows_cover_their_bytes(tmp_path):
+    raw = (b"abc \xff\xfe def \xe2\x82 ghi caf\xc3\xa9 " * 40 + b"\n" +
+           "grüße naïve ".encode("utf-8") * 60 + b"\n")
+    path = tmp_path / "text"
+    path.write_bytes(raw)
+    text = MappedText(str(path))
+
+    paginator = Paginator(Font(), [400, 100])
+    for page in paginator.iter_pages(text):
+        for line in page:
+            row = raw[line.start:line.end].decode("utf-8", "surrogateescape")
+            shown = row.translate(_escaped_bytes).replace("\n", " ")
+            assert shown.split() == line.text.split()
+        again = paginator.page_between(text, page.start, page.end)
+        assert rows(again) == rows(page)
+    text.close()
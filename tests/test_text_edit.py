@@ -0,0 +1,68 @@
+import random
+
+from paperui.ui import TextEdit
+from paperui.text_buffer import TextBuffer
+from paperui.text_wrapper import TextWrapper
+
+class Owner(object):
+    dirty = False
+
+def test_buffer_reads_like_its_text():
+    rng = random.Random(7)
+    text = "one\ntwo three\n\nfour"
+    buffer = TextBuffer(text)
+    for i in range(300):
+        pos = rng.randint(0, len(text))
+        if rng.random() < 0.6:
+            insert = rng.choice(["a", "\n", "b c\n"])
+            buffer.insert(pos, insert)
+            text = text[:pos] + insert + text[pos:]
+        else:
+            count = rng.randint(1, 3)
+            buffer.delete(pos, count)
+            text = text[:pos] + text[pos + count:]
+
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, len(text))
+        assert buffer[start:end] == text[start:end]
+        assert buffer.find("\n", start, end) == text.find("\n", start, end)
+        assert buffer.rfind("\n", 0, end) == text.rfind("\n", 0, end)
+    assert buffer.text == text
+
+def test_rewrapping_edits_matches_wrapping_from_scratch():
+    rng = random.Random(3)
+    for trial in range(20):
+        edit = TextEdit(text="".join(rng.choice("ab  \n")
+                                     for i in range(rng.randint(0, 200))),
+                        rows=3)
+        edit.owner = Owner()
+        edit.width = rng.choice([60, 100, 300])
+        revision = None
+        for step in range(100):
+            edit.cursor_pos = rng.randint(0, len(edit._buffer))
+            action = rng.random()
+            if action < 0.5:
+                edit.insert_char(rng.choice("abc  \n"))
+            elif action < 0.7:
+                edit.delete_backward(rng.randint(1, 3))
+            elif action < 0.8:
+                edit.delete_forward(rng.randint(1, 3))
+            elif action < 0.82:
+                edit.kill_line()
+            elif action < 0.84:
+                edit.text = "new text\nhere " * rng.randint(0, 5)
+
+            if rng.random() < 0.4:
+                edit.wrap()
+                rows, row, column = TextWrapper().wrap(
+                    edit.text, edit.cursor_pos, edit.wrapper.width)
+                assert edit.lines == rows
+                assert edit.cursor_loc == [row, column]
+
+def test_render_key_follows_edits_without_joining():
+    edit = TextEdit(text="some text", rows=3)
+    edit.owner = Owner()
+    key = edit.cache_key()
+    edit.insert_char("x")
+    assert edit.cache_key() != key
+    assert edit._buffer._text is None